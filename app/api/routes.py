@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
@@ -6,7 +8,9 @@ from app.db import crud, schemas
 from app.db.database import get_db
 import app.services.thingsboard as tb
 import app.services.datacake_client as dk
-from app.scheduler.scheduler import remove_running_job, schedule_tb_pile_monitor_job, schedule_dk_pile_monitor_job
+from app.services import duration_forecast
+from app.services import telemetry_store as store
+from app.scheduler.scheduler import fleet, remove_running_job, schedule_tb_pile_monitor_job, schedule_dk_pile_monitor_job
 
 
 router = APIRouter()
@@ -24,11 +28,31 @@ def create_pile(pile: schemas.CompostPileCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Pile already exists for this device")
     return crud.create_pile(db, pile)
 
+@router.get("/piles/{pile_id}/series")
+def get_pile_series(pile_id: int, variable: str,
+                    resolution: Optional[Literal["hour", "day"]] = None,
+                    from_ts: Optional[int] = Query(None, alias="from", description="POSIX timestamp in ms"),
+                    to_ts: Optional[int] = Query(None, alias="to", description="POSIX timestamp in ms, excluded")):
+    """
+    Hourly or daily stats of a variable of a pile (temperature, moisture, ph,
+    or a raw telemetry key), merged over its devices, hourly for ranges up
+    to a week by default.
+    """
+    with get_db() as db:
+        if not crud.get_pile(db, pile_id):
+            raise HTTPException(status_code=404, detail="Pile not found")
+    resolution = resolution or store.rollup_resolution(from_ts, to_ts)
+    return {
+        "pile_id": pile_id,
+        "variable": variable,
+        "resolution": resolution,
+        "points": store.rollup_series(pile_id, variable, resolution, from_ts, to_ts)
+    }
+
 @router.get("/thingsboard/monitor/{asset_id}")
 def add_monitor_job(asset_id: str, db: Session = Depends(get_db)):
     try:
-        token = tb.login_tb()
-        if not tb.get_asset_info(asset_id, token):
+        if not tb.get_asset_info(asset_id):
             return JSONResponse(content={'status': f'Asset: {asset_id} not found'}, status_code=404)
 
         job_id = schedule_tb_pile_monitor_job(asset_id=asset_id)
@@ -62,3 +86,21 @@ def cancel_datacake_monitor_job(workspace_id: str):
     except Exception as e:
         return JSONResponse(content={'status': f'Error: {str(e)}'}, status_code=500)
     return JSONResponse(content={'status': f'Job with id: {job_id} was cancelled'})
+
+
+@router.get("/fleet/status")
+def fleet_status():
+    return {
+        "assets": len(fleet),
+        "last_run": [
+            {**vars(r), "started_at": r.started_at.isoformat()} for r in fleet.last_report
+        ]
+    }
+
+@router.get("/fleet/duration-forecasts")
+def fleet_duration_forecasts(skip: int = 0, limit: int = 1000):
+    """Remaining duration forecasts of the stored piles, from local data only."""
+    with get_db() as db:
+        piles = crud.get_all_piles(db, skip=skip, limit=limit) or []
+    forecasts = duration_forecast.forecast_fleet(piles)
+    return {"piles": [{"pile_id": pile_id, **forecast.as_dict()} for pile_id, forecast in forecasts.items()]}
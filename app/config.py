@@ -9,6 +9,19 @@ class Settings(BaseSettings):
     THINGSBOARD_URL: Optional[str] = None
     THINGSBOARD_USERNAME: Optional[str] = None
     THINGSBOARD_PASSWORD: Optional[str] = None
+    THINGSBOARD_POOL_SIZE: int = 10
+    THINGSBOARD_TIMEOUT: float = 30  # Seconds, of the sync and async clients
+    THINGSBOARD_TOKEN_REFRESH_MARGIN: int = 60  # Seconds before JWT expiry to log in again
+    THINGSBOARD_PAGE_LIMIT: int = 10000
+    THINGSBOARD_HISTORY_WINDOW_DAYS: float = 7
+    THINGSBOARD_HISTORY_WORKERS: int = 4
+    THINGSBOARD_DAILY_STATS_MODE: str = "aggregate"  # "aggregate" (server-side) or "raw"
+    THINGSBOARD_DAILY_STATS_STD: bool = False  # Std needs the raw values of the day
+    THINGSBOARD_ASYNC_JOBS: bool = False  # Gather independent calls of an asset run with asyncio
+    THINGSBOARD_STREAMING: bool = False  # Follow monitored devices over the telemetry WebSocket
+    THINGSBOARD_WS_URL: Optional[str] = None  # Defaults to the telemetry endpoint of THINGSBOARD_URL
+    THINGSBOARD_STREAM_BATCH_SIZE: int = 500
+    THINGSBOARD_STREAM_FLUSH_INTERVAL: float = 30  # Seconds
     THINGBOARD_DEVICES: List = [
         {
             "id": "bb92afc0-944d-11ef-b50f-a1e8c9b20032",
@@ -28,18 +41,63 @@ class Settings(BaseSettings):
             "AgriFood Soil PH": ["PH1_SOIL"],
             "AgriFood Soil Moisture EC": ["SOIL_MOISTURE", "SOIL_TEMPERATURE"]
     }
+    DATACAKE_BATCH_SIZE: int = 20  # Workspaces per batched GraphQL request
+    DATACAKE_HISTORY_RESOLUTION: str = "20m"  # Temperature history, approx the sampling the moving average expects
+    DATACAKE_WORKSPACE_NAMES_TTL: int = 3600  # Seconds
 
     # Weather
     WEATHER_SERVICE_URL: str = 'http://weathersrv'
+    WEATHER_GRID_PRECISION: int = 2  # Decimals of the coordinates sharing a forecast, 2 is about 1 km
+    WEATHER_FORECAST_TTL: int = 10800  # Seconds, the provider updates its forecasts every 3 hours
 
     # Farm Calendr
     FARM_CALENDAR_URL: str = 'http://farmcalendar'
     FC_USERNAME: str = 'user'
     FC_PASSWORD: str = 'password'
+    FC_LOGIN_URL: str = 'https://gk.sip5.horizon-openagri.eu/api/login/'
+    FC_REFRESH_URL: str = 'https://gk.sip5.horizon-openagri.eu/api/refresh/'
+    FC_TOKEN_REFRESH_MARGIN: int = 60  # Seconds before expiry a token is renewed
+    FC_POOL_SIZE: int = 10
     COMPOST_OPERATION_ID : str = ''
+    FC_COMPOST_OPERATIONS_TTL: int = 900  # Seconds, used when COMPOST_OPERATION_ID is not set
     PH_ACTIVITY_TYPE_ID: str = 'ph-act-type-id'
     TEMP_ACTIVITY_TYPE_ID: str = 'temp-act-type-id'
     HUMIDITY_ACTIVITY_TYPE_ID: str = 'hum-act-type-id'
+    # Outbox of observations that could not be posted when they were made
+    FC_OUTBOX_INTERVAL_MINUTES: int = 10
+    FC_OUTBOX_BATCH_SIZE: int = 200
+    FC_OUTBOX_WORKERS: int = 4
+    FC_OUTBOX_RETRIES: int = 3
+    FC_OUTBOX_BACKOFF: float = 1  # Seconds, doubled on every retry
+    FC_OUTBOX_MAX_ATTEMPTS: int = 24  # Runs an observation may fail before it is parked; a 4xx rejection parks it at once
+
+    # Temperature analysis
+    TEMPERATURE_GRID: str = "20min"  # Regular grid the series are resampled onto, whatever the sensor sampling
+    TEMPERATURE_MA_WINDOW: str = "2h"  # Time-based moving average
+    TEMPERATURE_MAX_GAP: str = "2h"  # Longer gaps stay missing instead of interpolated
+
+    # Remaining duration forecast
+    DURATION_SCENARIOS: int = 2000  # Monte Carlo scenarios per pile
+    DURATION_HORIZON_DAYS: int = 365  # Completion later than this is reported as unknown
+    DURATION_PERCENTILES: List[float] = [10, 50, 90]
+    DURATION_SEED: int = 0
+
+    # Recommendation rules
+    RULES_DIR: Optional[str] = None  # Directory of <rule set>.json files, the bundled app/rules otherwise
+    RULE_SET: str = "default"  # Rule set of piles that do not name their own
+
+    # Scheduling
+    SCHEDULER_MODE: str = "per_asset"  # "per_asset" (one cron job per asset) or "fleet" (one pooled job)
+    FLEET_WORKERS: int = 8
+    FLEET_HOUR: int = 23
+    FLEET_MINUTE: int = 0
+    # Maximum concurrent requests per upstream service, across all jobs
+    UPSTREAM_CONCURRENCY: Dict = {
+            "thingsboard": 8,
+            "datacake": 4,
+            "farm_calendar": 4,
+            "weather": 4
+    }
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -1,7 +1,13 @@
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 
+import numpy as np
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.orm import Session
 from app.db import models, schemas
+from app.services.stats import DAY_MS, bucket_stats
+
+TELEMETRY_INSERT_BATCH = 5000
+ROLLUP_PERIODS = {"hour": 3_600_000, "day": DAY_MS}  # Rollup resolutions, bucket length in ms
 
 def get_pile(db: Session, pile_id: int) -> Optional[models.CompostPile]:
     return db.query(models.CompostPile).filter(models.CompostPile.id == pile_id).first()
@@ -40,3 +46,245 @@ def mark_observation_as_sent(db: Session, obs_id: int) -> Optional[models.Observ
         db.commit()
         db.refresh(obs)
     return obs
+
+def get_unsent_observations_after(db: Session, after_id: int, limit: int,
+                                  max_attempts: Optional[int] = None) -> List[Tuple[models.Observation, Optional[str]]]:
+    """Next page of unsent observations by id, with the name of their pile, skipping the parked ones."""
+    query = (db.query(models.Observation, models.CompostPile.name)
+             .outerjoin(models.CompostPile, models.Observation.pile_id == models.CompostPile.id)
+             .filter(models.Observation.sent == 0, models.Observation.id > after_id))
+    if max_attempts is not None:
+        query = query.filter(models.Observation.attempts < max_attempts)
+    return [tuple(row) for row in query
+            .order_by(models.Observation.id)
+            .limit(limit)
+            .all()] # type: ignore [reportReturnType]
+
+def mark_observations_as_sent(db: Session, obs_ids: List[int]) -> int:
+    if not obs_ids:
+        return 0
+    updated = db.query(models.Observation).filter(
+        models.Observation.id.in_(obs_ids)).update({models.Observation.sent: 1}, synchronize_session=False)
+    db.commit()
+    return updated
+
+def record_observation_failures(db: Session, errors: Dict[int, str], parked: List[int], max_attempts: int) -> int:
+    """
+    Count a failed attempt and keep the error of each observation in `errors`.
+    The `parked` ones jump to `max_attempts`, so the outbox skips them from
+    now on. Returns the number of observations parked.
+    """
+    o = models.Observation
+    for obs_id, error in errors.items():
+        attempts = max_attempts if obs_id in parked else o.attempts + 1
+        db.query(o).filter(o.id == obs_id).update({o.attempts: attempts, o.last_error: error}, synchronize_session=False)
+    db.commit()
+    return db.query(o).filter(o.id.in_(list(errors)), o.attempts >= max_attempts).count() if errors else 0
+
+# Telemetry
+def _upsert(db: Session, table, index_elements: List[str], update_columns: List[str], where=None):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(table)
+    stmt = dialect_insert(table)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={c: stmt.excluded[c] for c in update_columns},
+        where=where)
+
+def get_telemetry_watermark(db: Session, pile_id: int, device_id: str, key: str) -> Optional[int]:
+    return db.query(models.TelemetryWatermark.last_ts).filter(
+        models.TelemetryWatermark.pile_id == pile_id,
+        models.TelemetryWatermark.device_id == device_id,
+        models.TelemetryWatermark.key == key).scalar()
+
+def get_oldest_telemetry_watermark(db: Session, pile_id: int, keys: List[str]) -> Optional[int]:
+    """Oldest watermark of the given keys over all devices of a pile."""
+    return db.query(func.min(models.TelemetryWatermark.last_ts)).filter(
+        models.TelemetryWatermark.pile_id == pile_id,
+        models.TelemetryWatermark.key.in_(keys)).scalar()
+
+def _telemetry_series_id(db: Session, pile_id: int, device_id: str, key: str, create: bool = False) -> Optional[int]:
+    s = models.TelemetrySeries
+    query = select(s.id).where(s.pile_id == pile_id, s.device_id == device_id, s.key == key)
+    series_id = db.execute(query).scalar()
+    if series_id is None and create:
+        # Concurrent writers of a new series both get the row created by the first one
+        db.execute(_upsert(db, s.__table__, ["pile_id", "device_id", "key"], []),
+                   {"pile_id": pile_id, "device_id": device_id, "key": key})
+        series_id = db.execute(query).scalar()
+    return series_id
+
+def _series_points(db: Session, series_id: int, start_ts: Optional[int] = None,
+                   end_ts: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    p = models.TelemetryPoint
+    query = select(p.ts, p.value).where(p.series_id == series_id)
+    if start_ts is not None:
+        query = query.where(p.ts >= start_ts)
+    if end_ts is not None:
+        query = query.where(p.ts < end_ts)
+    rows = db.execute(query.order_by(p.ts)).all()
+    ts = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((np.nan if r[1] is None else r[1] for r in rows), dtype=np.float64, count=len(rows))
+    return ts, values
+
+def _refresh_rollups(db: Session, series_id: int, ts: np.ndarray, values: np.ndarray, watermark: Optional[int]):
+    """
+    Recompute the hourly and daily rollups of the days touched by new points.
+    Points appended after the watermark are merged with the stored points of
+    their first day only; points at or before it may overwrite stored ones,
+    so the touched days are read back.
+    """
+    start = int(ts.min()) - int(ts.min()) % DAY_MS
+    end = int(ts.max()) - int(ts.max()) % DAY_MS + DAY_MS
+    if watermark is not None and int(ts.min()) <= watermark:
+        ts, values = _series_points(db, series_id, start, end)
+    else:
+        stored_ts, stored_values = _series_points(db, series_id, start, int(ts.min()))
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+        # The last of duplicate timestamps is the one stored
+        last = np.append(ts[1:] != ts[:-1], True)
+        ts, values = np.concatenate([stored_ts, ts[last]]), np.concatenate([stored_values, values[last]])
+
+    r = models.TelemetryRollup
+    db.execute(delete(r).where(r.series_id == series_id, r.start >= start, r.start < end))
+    for resolution, period in ROLLUP_PERIODS.items():
+        starts, counts, means, m2s, mins, maxs = bucket_stats(ts, values, period)
+        if len(starts):
+            db.execute(_upsert(db, r.__table__, ["series_id", "resolution", "start"], ["count", "mean", "m2", "min", "max"]), [
+                {"series_id": series_id, "resolution": resolution, "start": b, "count": c,
+                 "mean": mean, "m2": m2, "min": lo, "max": hi}
+                for b, c, mean, m2, lo, hi in zip(starts.tolist(), counts.tolist(), means.tolist(),
+                                                  m2s.tolist(), mins.tolist(), maxs.tolist())])
+
+def insert_telemetry(db: Session, pile_id: int, device_id: str, key: str,
+                     ts: np.ndarray, values: np.ndarray) -> int:
+    """
+    Bulk upsert one series, refresh its rollups and advance its watermark in a
+    single transaction.
+    """
+    if not len(ts):
+        return 0
+
+    series_id = _telemetry_series_id(db, pile_id, device_id, key, create=True)
+    stmt = _upsert(db, models.TelemetryPoint.__table__, ["series_id", "ts"], ["value"])
+    for start in range(0, len(ts), TELEMETRY_INSERT_BATCH):
+        rows = [
+            {"series_id": series_id, "ts": t, "value": v}
+            for t, v in zip(ts[start:start + TELEMETRY_INSERT_BATCH].tolist(),
+                            values[start:start + TELEMETRY_INSERT_BATCH].tolist())
+        ]
+        db.execute(stmt, rows)
+
+    _refresh_rollups(db, series_id, np.asarray(ts, dtype=np.int64), np.asarray(values, dtype=np.float64), # type: ignore [reportArgumentType]
+                     get_telemetry_watermark(db, pile_id, device_id, key))
+    # Concurrent writers of a series (stream flushes, syncs) only ever move the watermark forward
+    last_ts = int(np.max(ts))
+    w = models.TelemetryWatermark.__table__
+    db.execute(_upsert(db, w, ["pile_id", "device_id", "key"], ["last_ts"], where=w.c.last_ts < last_ts),
+               {"pile_id": pile_id, "device_id": device_id, "key": key, "last_ts": last_ts})
+    db.commit()
+    return len(ts)
+
+def get_telemetry(db: Session, pile_id: int, device_id: str, key: str,
+                  start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the stored (ts, value) arrays of one series in ascending time order."""
+    series_id = _telemetry_series_id(db, pile_id, device_id, key)
+    if series_id is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return _series_points(db, series_id, start_ts, end_ts)
+
+def get_telemetry_keys(db: Session, pile_id: int) -> List[str]:
+    """Distinct keys of the stored series of a pile, over all its devices."""
+    s = models.TelemetrySeries
+    return list(db.scalars(select(s.key).where(s.pile_id == pile_id).distinct()).all())
+
+def get_telemetry_rollups(db: Session, pile_id: int, keys: List[str], resolution: str,
+                          start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[models.TelemetryRollup]:
+    """Rollups of the given keys of a pile starting in [start_ts, end_ts), over all its devices, oldest first."""
+    r, s = models.TelemetryRollup, models.TelemetrySeries
+    query = select(r).join(s, s.id == r.series_id).where(s.pile_id == pile_id, s.key.in_(keys), r.resolution == resolution)
+    if start_ts is not None:
+        query = query.where(r.start >= start_ts)
+    if end_ts is not None:
+        query = query.where(r.start < end_ts)
+    return list(db.scalars(query.order_by(r.start)).all())
+
+# Phase states
+def get_phase_state(db: Session, pile_id: int, device_id: str, key: str) -> Optional[models.PhaseState]:
+    return db.get(models.PhaseState, (pile_id, device_id, key))
+
+def save_phase_state(db: Session, state: Dict) -> None:
+    """Insert or replace the phase state of a series, given as a column dict."""
+    index = ["pile_id", "device_id", "key"]
+    db.execute(_upsert(db, models.PhaseState.__table__, index, [c for c in state if c not in index]), [state])
+    db.commit()
+
+# Daily stats
+def save_daily_stats(db: Session, pile_id: int, device_id: str, key: str, day: int,
+                     count: int, mean: float, m2: Optional[float], min_value: float, max_value: float) -> None:
+    """Insert or replace the accumulator of one day of a series."""
+    stmt = _upsert(db, models.DailyStats.__table__, ["pile_id", "device_id", "key", "day"], ["count", "mean", "m2", "min", "max"])
+    db.execute(stmt, [{"pile_id": pile_id, "device_id": device_id, "key": key, "day": day,
+                       "count": count, "mean": mean, "m2": m2, "min": min_value, "max": max_value}])
+    db.commit()
+
+def get_pile_daily_stats(db: Session, pile_id: int, start_day: Optional[int] = None) -> List[models.DailyStats]:
+    """Stored days of every series of a pile, oldest first."""
+    t = models.DailyStats
+    query = select(t).where(t.pile_id == pile_id)
+    if start_day is not None:
+        query = query.where(t.day >= start_day)
+    return list(db.scalars(query.order_by(t.day)).all())
+
+# Weather forecasts
+def get_weather_forecast(db: Session, latitude: float, longitude: float) -> Optional[models.WeatherForecast]:
+    return db.get(models.WeatherForecast, (latitude, longitude))
+
+def save_weather_forecast(db: Session, latitude: float, longitude: float, fetched_at: int, payload: str):
+    stmt = _upsert(db, models.WeatherForecast.__table__, ["latitude", "longitude"], ["fetched_at", "payload"])
+    db.execute(stmt, [{"latitude": latitude, "longitude": longitude, "fetched_at": fetched_at, "payload": payload}])
+    db.commit()
+
+# Ambient weather
+AMBIENT_INSERT_BATCH = 5000
+
+def insert_ambient_weather(db: Session, latitude: float, longitude: float, ts: np.ndarray,
+                           values: Dict[str, np.ndarray]) -> int:
+    """
+    Bulk upsert the ambient values of a grid cell, one array per property
+    aligned with `ts`. NaN values are skipped, newer values replace older ones.
+    """
+    t = models.AmbientWeather.__table__
+    stmt = _upsert(db, t, ["latitude", "longitude", "property", "ts"], ["value"])
+    rows = [
+        {"latitude": latitude, "longitude": longitude, "property": prop, "ts": point_ts, "value": value}
+        for prop, prop_values in values.items()
+        for point_ts, value in zip(ts.tolist(), np.asarray(prop_values, dtype=np.float64).tolist())
+        if value == value
+    ]
+    for start in range(0, len(rows), AMBIENT_INSERT_BATCH):
+        db.execute(stmt, rows[start:start + AMBIENT_INSERT_BATCH])
+    db.commit()
+    return len(rows)
+
+def get_ambient_weather(db: Session, latitude: float, longitude: float, prop: str,
+                        start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the stored (ts, value) arrays of one property of a grid cell in ascending time order."""
+    t = models.AmbientWeather
+    query = select(t.ts, t.value).where(t.latitude == latitude, t.longitude == longitude, t.property == prop)
+    if start_ts is not None:
+        query = query.where(t.ts >= start_ts)
+    if end_ts is not None:
+        query = query.where(t.ts < end_ts)
+    rows = db.execute(query.order_by(t.ts)).all()
+    ts = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    return ts, values
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Date, Integer, String, Float, ForeignKey
+from sqlalchemy import BigInteger, Column, Date, Index, Integer, String, Float, ForeignKey, Text, UniqueConstraint
 from app.db.database import Base
 
 
@@ -28,3 +28,108 @@ class Observation(Base):
     max_value = Column(Float)
     date = Column(Date)
     sent = Column(Integer, default=0)
+    source = Column(String, nullable=True)  # Telemetry platform, named as the sensor in Farm Calendar
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")  # Failed outbox runs, parked at FC_OUTBOX_MAX_ATTEMPTS
+    last_error = Column(String, nullable=True)
+
+    # Keyset scans of the outbox: WHERE sent = 0 AND id > ? ORDER BY id
+    __table_args__ = (Index("ix_observations_sent_id", "sent", "id"),)
+
+class TelemetrySeries(Base):
+    __tablename__ = "telemetry_series"
+
+    # One row per stored series, so points carry a small id instead of its keys
+    id = Column(Integer, primary_key=True)
+    pile_id = Column(Integer, ForeignKey("compost_piles.id"), nullable=False)
+    device_id = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+
+    __table_args__ = (UniqueConstraint("pile_id", "device_id", "key", name="uq_telemetry_series"),)
+
+class TelemetryPoint(Base):
+    __tablename__ = "telemetry_points"
+
+    series_id = Column(Integer, ForeignKey("telemetry_series.id"), primary_key=True)
+    ts = Column(BigInteger, primary_key=True)  # POSIX timestamp in ms
+    value = Column(Float)
+
+    # Clustered on the primary key in SQLite, as range scans of one series are the only reads
+    __table_args__ = {"sqlite_with_rowid": False}
+
+class TelemetryRollup(Base):
+    __tablename__ = "telemetry_rollups"
+
+    # Mergeable accumulator of the points of a series in one hour or day, see services.stats
+    series_id = Column(Integer, ForeignKey("telemetry_series.id"), primary_key=True)
+    resolution = Column(String, primary_key=True)  # hour, day
+    start = Column(BigInteger, primary_key=True)  # Start of the bucket, POSIX timestamp in ms
+    count = Column(Integer, nullable=False)
+    mean = Column(Float, nullable=False)
+    m2 = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+class TelemetryWatermark(Base):
+    __tablename__ = "telemetry_watermarks"
+
+    pile_id = Column(Integer, ForeignKey("compost_piles.id"), primary_key=True)
+    device_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    last_ts = Column(BigInteger, nullable=False)  # Newest stored timestamp in ms
+
+class WeatherForecast(Base):
+    __tablename__ = "weather_forecasts"
+
+    # Grid cell of the rounded coordinates the forecast was requested for
+    latitude = Column(Float, primary_key=True)
+    longitude = Column(Float, primary_key=True)
+    fetched_at = Column(BigInteger, nullable=False)  # POSIX timestamp in ms
+    payload = Column(Text, nullable=False)  # forecast5 JSON-LD response
+
+class AmbientWeather(Base):
+    __tablename__ = "ambient_weather"
+
+    # Same grid cells as the forecast cache
+    latitude = Column(Float, primary_key=True)
+    longitude = Column(Float, primary_key=True)
+    property = Column(String, primary_key=True)  # temperature, humidity, precipitation
+    ts = Column(BigInteger, primary_key=True)  # POSIX timestamp in ms
+    value = Column(Float, nullable=False)
+
+class PhaseState(Base):
+    __tablename__ = "phase_states"
+
+    # State of the phase detector over a temperature series of a pile
+    pile_id = Column(Integer, ForeignKey("compost_piles.id"), primary_key=True)
+    device_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    last_ts = Column(BigInteger, nullable=False)  # Newest processed grid point, POSIX timestamp in ms
+    first_ts = Column(BigInteger, nullable=False)
+    latest_temp = Column(Float)  # Moving average at last_ts
+    current_phase = Column(String, nullable=False)
+    thermophilic_started = Column(Integer, nullable=False, default=0)
+    thermophilic_start_ts = Column(BigInteger, nullable=True)
+    thermophilic_end_ts = Column(BigInteger, nullable=True)
+    thermophilic_days = Column(Integer, nullable=False, default=0)
+    consecutive_above = Column(Integer, nullable=False, default=0)
+    consecutive_below = Column(Integer, nullable=False, default=0)
+    mesophilic_entered = Column(Integer, nullable=False, default=0)
+    thermophilic_entered = Column(Integer, nullable=False, default=0)
+    cooling_entered = Column(Integer, nullable=False, default=0)
+    maturation_entered = Column(Integer, nullable=False, default=0)
+
+class DailyStats(Base):
+    __tablename__ = "daily_stats"
+
+    # Mergeable accumulator of one UTC day of a series, see services.stats
+    pile_id = Column(Integer, ForeignKey("compost_piles.id"), primary_key=True)
+    device_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    day = Column(BigInteger, primary_key=True)  # Start of the day, POSIX timestamp in ms
+    count = Column(Integer, nullable=False)
+    mean = Column(Float, nullable=False)
+    m2 = Column(Float, nullable=True)  # Unknown for stats reduced by ThingsBoard
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
@@ -10,6 +10,7 @@ class CompostAttributes(BaseModel):
     latitude: float
     longitude: float
     fc_compost_operation_id: Optional[str | None] = None
+    rule_set: Optional[str] = None  # Recommendation rule set, RULE_SET when not given
 
 class CompostPileBase(BaseModel):
     name: str
@@ -41,6 +42,7 @@ class ObservationBase(BaseModel):
     max_value: float
     date: datetime
     sent: int = 0
+    source: Optional[str] = None
 
 class ObservationCreate(ObservationBase):
     pass
@@ -0,0 +1,89 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class FleetAsset:
+    asset_id: str
+    func: Callable[..., bool]
+    args: tuple
+
+
+@dataclass
+class AssetRunResult:
+    asset_id: str
+    success: bool
+    started_at: datetime.datetime
+    duration: float  # Seconds
+    error: Optional[str] = None
+
+
+class Fleet:
+    """
+    Registry of every monitored asset, run by a single scheduled job.
+
+    Instead of one cron job per asset all firing at the same minute, the
+    pipelines go through a worker pool of a fixed size. Together with the
+    per-upstream caps of `app.services.upstreams`, this keeps the total runtime
+    predictable and the load on the upstream services bounded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assets: Dict[str, FleetAsset] = {}
+        self.last_report: List[AssetRunResult] = []
+
+    def add(self, asset_id: str, func: Callable[..., bool], args: tuple):
+        with self._lock:
+            self._assets[asset_id] = FleetAsset(asset_id, func, tuple(args))
+
+    def remove(self, asset_id: str) -> bool:
+        with self._lock:
+            return self._assets.pop(asset_id, None) is not None
+
+    def assets(self, func: Callable[..., bool]) -> List[FleetAsset]:
+        """Assets run by the given pipeline."""
+        with self._lock:
+            return [a for a in self._assets.values() if a.func is func]
+
+    def asset_ids(self, func: Callable[..., bool]) -> List[str]:
+        """Ids of the assets run by the given pipeline."""
+        with self._lock:
+            return [a.asset_id for a in self._assets.values() if a.func is func]
+
+    def __contains__(self, asset_id) -> bool:
+        return asset_id in self._assets
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def run(self, workers: int = 8) -> List[AssetRunResult]:
+        with self._lock:
+            assets = list(self._assets.values())
+        logging.info(f"🚜 Running fleet job for {len(assets)} assets with {workers} workers")
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="fleet") as executor:
+            report = list(executor.map(self._run_asset, assets))
+
+        failed = [r.asset_id for r in report if not r.success]
+        logging.info(f"Fleet job done: {len(report) - len(failed)} succeeded, {len(failed)} failed")
+        if failed:
+            logging.warning(f"Failed assets: {', '.join(failed)}")
+        self.last_report = report
+        return report
+
+    @staticmethod
+    def _run_asset(asset: FleetAsset) -> AssetRunResult:
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        start = time.monotonic()
+        try:
+            success, error = bool(asset.func(*asset.args)), None
+        except Exception as e:
+            logging.exception(e)
+            success, error = False, str(e)
+        return AssetRunResult(asset.asset_id, success, started_at, time.monotonic() - start, error)
@@ -1,9 +1,9 @@
+import asyncio
 import datetime
-import json
 import logging
-from typing import Optional
+from typing import Dict, Optional
 
-import numpy as np
+import httpx
 import pandas as pd
 
 from app.config import settings
@@ -14,132 +14,282 @@ from app.db.models import CompostPile
 from app.db.schemas import CompostPileCreate, ObservationCreate
 from app.services.pile_monitor import analyze_compost_status
 import app.services.thingsboard as tb
+from app.services.thingsboard_async import AsyncThingsBoardClient
+from app.services.thingsboard_stream import stream as tb_stream
 import app.services.datacake_client as dk
+from app.services import telemetry_store as store
+from app.services import phase_tracker as phases
+from app.services import duration_forecast
+from app.services.stats import StatsAccumulator
 from app.services import weather_service as ws
 from app.services import farm_calendar as fc
 
 
 FC_COMPOST_OPERATION_ID = settings.COMPOST_OPERATION_ID
+# The phase inference looks at the moving average trend of the last 70 grid points
+TEMPERATURE_TAIL_POINTS = 72
+
+
+def _get_or_create_tb_pile(asset_id, asset_attrs, asset_info) -> CompostPile:
+    with get_db() as db_session:
+        db_pile = dao.get_pile_by_ext_id(db_session, asset_id)
+        if not db_pile:
+            # Extract metadata from pre-fetched asset attributes
+            pile = CompostPileCreate(
+                name=asset_info.get('name', ''),
+                ext_id=asset_id,
+                start_date=datetime.datetime.fromtimestamp(asset_attrs.get("start_date", 0) / 1000),
+                greens=asset_attrs.get("Greens_(KG)", 0),
+                browns=asset_attrs.get("Browns_(KG)", 0),
+                latitude=float(asset_attrs.get('Latitude', 0.0)),
+                longitude=float(asset_attrs.get('Longitude', 0.0))
+            )
+            db_pile = dao.create_pile(db_session, pile)
+    return db_pile
+
+
+def _tb_device_config(device_name) -> Optional[dict]:
+    # Look up telemetry keys from DEVICES
+    config = next((d for d in settings.THINGBOARD_DEVICES if d["name"] == device_name), None)
+    if not config:
+        logging.warning(f"No config for device {device_name}, skipping")
+    return config
+
+
+def _load_temperature_history(db_pile: CompostPile, device_id, key) -> pd.DataFrame:
+    """
+    Advance the stored phase state of the pile over the new points, and read
+    only the recent part of the series the phase inference looks at, as a
+    moving average on the regular temperature grid.
+    """
+    _, changes = phases.advance_phase_state(db_pile.id, device_id, key) # type: ignore [reportArgumentType]
+    for when, change in changes:
+        logging.info(f"Pile {db_pile.id}: {change} at {when}")
+    temp_ma = store.load_temperature_ma(db_pile.id, device_id, key, TEMPERATURE_TAIL_POINTS) # type: ignore [reportArgumentType]
+    return pd.DataFrame({"temp_ma": temp_ma})
+
+
+def _load_tb_temperature_history(db_pile: CompostPile, device_id, key) -> pd.DataFrame:
+    # Fetch only the TEMPERATURE delta, then read the history locally
+    store.sync_thingsboard_series(db_pile.id, device_id, key, db_pile.start_date) # type: ignore [reportArgumentType]
+    return _load_temperature_history(db_pile, device_id, key)
+
+
+def _compost_operation_id(pile_name, fc_token) -> Optional[str]:
+    """The configured compost operation, otherwise the one Farm Calendar has for the pile."""
+    if FC_COMPOST_OPERATION_ID or not fc_token:
+        return FC_COMPOST_OPERATION_ID or None
+    try:
+        compost = fc.compost_operations.get(pile_name, fc_token)
+    except Exception as e:
+        logging.error(f"Error fetching compost operations: {e}")
+        return None
+    return fc.compost_operation_id(compost) if compost else None
+
+
+def _send_observation(db_pile: CompostPile, device_id, device_name, variable, stats, source, fc_token):
+    compost_operation_id = _compost_operation_id(db_pile.name, fc_token)
+    observation_dict = utils.create_observation_payload(
+        variable, stats['min'], stats['max'], stats['avg'],
+        db_pile.name, source=source
+    )
+    success = fc.post_observation_to_fc(compost_operation_id, observation_dict, fc_token)
+    msg = "✅ Sent Observation to Farm Calendar" if success else "❌ Observation not sent"
+    logging.info(f"{msg}: compost operation id: {compost_operation_id}")
+
+    if not success:
+        obs = ObservationCreate(
+                device_id=device_id, device_name=device_name, pile_id=db_pile.id, # type: ignore [reportArgumentType]
+                fc_compost_operation_id=compost_operation_id, variable=variable,
+                mean_value=stats['avg'],
+                min_value=stats['min'], max_value=stats['max'],
+                date=datetime.datetime.now(datetime.timezone.utc), sent=success,
+                source=source
+            )
+        with get_db() as db_session:
+            dao.create_observation(db_session, obs)
+
+
+def _get_tb_device_daily_stats(db_pile: CompostPile, config) -> dict:
+    """Today's stats from the telemetry stream when it follows the device, otherwise from ThingsBoard."""
+    if tb_stream.running:
+        tb_stream.watch(db_pile.id, config["id"], config["keys"], db_pile.start_date) # type: ignore [reportArgumentType]
+        device_stats = tb_stream.get_daily_stats(db_pile.id, config["id"], config["keys"]) # type: ignore [reportArgumentType]
+        if device_stats is not None:
+            return device_stats
+    # Get daily stats, reduced server-side by ThingsBoard where possible
+    return tb.get_daily_stats_for_current_day(config["id"], config["keys"])
+
+
+def _save_daily_stats(db_pile: CompostPile, device_id, key, stats: StatsAccumulator):
+    """Keep today's accumulator of a series, so longer periods merge stored days."""
+    try:
+        store.save_daily_stats(db_pile.id, device_id, key, stats) # type: ignore [reportArgumentType]
+    except Exception as e:
+        logging.error(f"Daily stats of '{key}' for device {device_id} not stored: {e}")
+
+
+def _analyze_pile(db_pile: CompostPile, temp_df, daily_stats, forecast, rule_set=None):
+    results = analyze_compost_status(
+        temp_df, daily_stats,
+        db_pile.start_date, db_pile.greens, db_pile.browns, # type: ignore [reportArgumentType]
+        forecast["temperature"], forecast["humidity"],
+        rule_set=rule_set
+    )
+    try:
+        results.update(duration_forecast.forecast_pile(db_pile).as_dict())
+    except Exception as e:
+        logging.error(f"Duration forecast of pile {db_pile.id} failed: {e}")
+    return results
 
 
 def create_recommendation_for_pile(asset_id):
     logging.info(f"🔁 Running recommendation analysis for ThingsBoard Compost Pile: {asset_id}")
-    token = tb.login_tb()
-    if not token:
-        return
+    if not tb.login_tb():
+        return False
 
     try:
-        # Get server-side attributes
-        asset_attrs = tb.get_asset_attributes(asset_id, token)
-        asset_info = tb.get_asset_info(asset_id, token)
+        # Farm Calendar token shared by the observations and the forecast of this run
+        fc_token = fc.login_to_fc()
 
-        with get_db() as db_session:
-            db_pile = dao.get_pile_by_ext_id(db_session, asset_id)
-            if not db_pile:
-                # Extract metadata from pre-fetched asset attributes
-                pile = CompostPileCreate(
-                    name=asset_info.get('name', ''),
-                    ext_id=asset_id,
-                    start_date=datetime.datetime.fromtimestamp(asset_attrs.get("start_date", 0) / 1000),
-                    greens=asset_attrs.get("Greens_(KG)", 0),
-                    browns=asset_attrs.get("Browns_(KG)", 0),
-                    latitude=float(asset_attrs.get('Latitude', 0.0)),
-                    longitude=float(asset_attrs.get('Longitude', 0.0))
-                )
-                db_pile = dao.create_pile(db_session, pile)
+        # Get server-side attributes
+        asset_attrs = tb.get_asset_attributes(asset_id)
+        asset_info = tb.get_asset_info(asset_id)
+        db_pile = _get_or_create_tb_pile(asset_id, asset_attrs, asset_info)
 
         daily_stats = {}
         temp_df = pd.DataFrame()
 
-        for device_name in tb.get_devices_by_asset(asset_id, token):
-            # Look up telemetry keys from DEVICES
-            config = next((d for d in settings.THINGBOARD_DEVICES if d["name"] == device_name), None)
+        for device_name in tb.get_devices_by_asset(asset_id):
+            config = _tb_device_config(device_name)
             if not config:
-                logging.warning(f"No config for device {device_name}, skipping")
                 continue
 
             keys = config["keys"]
             device_id = config["id"]
-            # Get daily telemetry and calculate stats
-            token = tb.login_tb()
-            telemetry = tb.get_telemetry_for_current_day(config["id"], keys, token)
+            device_stats = _get_tb_device_daily_stats(db_pile, config)
             for key in keys:
-                datapoints = telemetry.get(key, [])
-                values = [float(dp["value"]) for dp in datapoints if "value" in dp]
-                if not values:
+                if key not in device_stats:
                     continue
 
-                # Rename columns
-                k = ''
-                if 'temp' in key.lower():
-                    k = 'temperature'
-                if 'water' in key.lower():
-                    k = 'moisture'
-                if 'ph' in key.lower():
-                    k = 'ph'
-
-                daily_stats[k] = {
-                    'min': np.min(values),
-                    'max': np.max(values),
-                    'avg': np.mean(values),
-                    'std': np.std(values)
-                }
-
-                # Get all TEMPERATURE telemetry
+                k = store.variable_name(key) or ''
+                daily_stats[k] = device_stats[key]
+                _save_daily_stats(db_pile, device_id, key, StatsAccumulator.from_dict(device_stats[key]))
+
                 if 'temp' in key.lower():
-                    token = tb.login_tb()
-                    temp_df = tb.get_all_telemetry_for_key_df(config["id"], key, db_pile.start_date, token)
-                    # Moving Average of Temperatures
-                    window = 6 # Appox 2 hours
-                    temp_df["temp_ma"] = temp_df[key].rolling(window=window, min_periods=1).mean()
+                    temp_df = _load_tb_temperature_history(db_pile, device_id, key)
 
                 if settings.FARM_CALENDAR_URL:
-                    observation_dict = utils.create_observation_payload(
-                        k, daily_stats[k]['min'],
-                        daily_stats[k]['max'], daily_stats[k]['avg'],
-                        db_pile.name, source='Thingsboard'
-                    )
-                    token = fc.login_to_fc()
-                    success = fc.post_observation_to_fc(FC_COMPOST_OPERATION_ID, observation_dict, token)
-                    msg = "✅ Sent Observation to Farm Calendar" if success else "❌ Observation not sent"
-                    logging.info(f"{msg}: compost operation id: {FC_COMPOST_OPERATION_ID}")
-
-                    if not success:
-                        obs = ObservationCreate(
-                                device_id=device_id, device_name=device_name, pile_id=db_pile.id, # type: ignore [reportArgumentType]
-                                fc_compost_operation_id=FC_COMPOST_OPERATION_ID, variable=k,
-                                mean_value=daily_stats[k]['avg'],
-                                min_value=daily_stats[k]['min'], max_value=daily_stats[k]['max'],
-                                date=datetime.datetime.now(datetime.timezone.utc), sent=success
-                            )
-                        with get_db() as db_session:
-                            obs = dao.create_observation(db_session, obs)
+                    _send_observation(db_pile, device_id, device_name, k, daily_stats[k], 'Thingsboard', fc_token)
 
         # Get weather forecast
-        forecast = ws.get_24h_forecast(db_pile.latitude, db_pile.longitude, fc.login_to_fc())
+        forecast = ws.get_24h_forecast(db_pile.latitude, db_pile.longitude, fc_token)
 
         # Parse attributes
-        results = analyze_compost_status(
-            temp_df, daily_stats,
-            db_pile.start_date, db_pile.greens, db_pile.browns, # type: ignore [reportArgumentType]
-            forecast["temperature"], forecast["humidity"], []
-        )
+        results = _analyze_pile(db_pile, temp_df, daily_stats, forecast, asset_attrs.get("Rule_set"))
 
-        token = tb.login_tb()
-        post_success = tb.post_recommendation_to_tb(asset_id, results, token)
+        post_success = tb.post_recommendation_to_tb(asset_id, results)
 
         msg = "✅ Sent Recommendation" if post_success else "❌ Recommendation not sent"
         logging.info(f"{msg}: asset {asset_id}")
+        return post_success
 
     except Exception as e:
         logging.error(f"Error processing asset {asset_id}: {e}")
         logging.exception(e)
+        return False
+
+
+async def _create_recommendation_for_pile_async(asset_id):
+    async with AsyncThingsBoardClient() as client:
+        # Metadata calls are independent of each other
+        asset_attrs, asset_info, device_names, fc_token = await asyncio.gather(
+            client.get_asset_attributes(asset_id),
+            client.get_asset_info(asset_id),
+            client.get_devices_by_asset(asset_id),
+            asyncio.to_thread(fc.login_to_fc))
+        db_pile = _get_or_create_tb_pile(asset_id, asset_attrs, asset_info)
+
+        configs = [(name, c) for name, c in ((name, _tb_device_config(name)) for name in device_names) if c]
+        temperature_keys = [(c["id"], key) for _, c in configs for key in c["keys"] if 'temp' in key.lower()]
+
+        async def device_daily_stats(config):
+            if tb_stream.running:
+                tb_stream.watch(db_pile.id, config["id"], config["keys"], db_pile.start_date) # type: ignore [reportArgumentType]
+                stats = tb_stream.get_daily_stats(db_pile.id, config["id"], config["keys"]) # type: ignore [reportArgumentType]
+                if stats is not None:
+                    return stats
+            try:
+                return await client.get_daily_stats_for_current_day(config["id"], config["keys"])
+            except (httpx.HTTPError, tb.ThingsBoardAuthError) as e:
+                logging.error(f"Daily stats of device {config['id']} unavailable, skipping it: {e}")
+                return {}
+
+        # Daily stats of every device, the temperature histories and the forecast are all independent
+        device_stats, temp_dfs, forecast = await asyncio.gather(
+            asyncio.gather(*(device_daily_stats(c) for _, c in configs)),
+            asyncio.gather(*(asyncio.to_thread(_load_tb_temperature_history, db_pile, device_id, key)
+                             for device_id, key in temperature_keys)),
+            asyncio.to_thread(ws.get_24h_forecast, db_pile.latitude, db_pile.longitude, fc_token))
+
+        daily_stats = {}
+        observations = []
+        for (device_name, config), stats in zip(configs, device_stats):
+            for key in config["keys"]:
+                if key not in stats:
+                    continue
+                k = store.variable_name(key) or ''
+                daily_stats[k] = stats[key]
+                _save_daily_stats(db_pile, config["id"], key, StatsAccumulator.from_dict(stats[key]))
+                observations.append((config["id"], device_name, k, stats[key]))
+
+        if settings.FARM_CALENDAR_URL:
+            await asyncio.gather(*(
+                asyncio.to_thread(_send_observation, db_pile, device_id, device_name, k, stats, 'Thingsboard', fc_token)
+                for device_id, device_name, k, stats in observations))
+
+        temp_df = next((df for df in reversed(temp_dfs) if not df.empty), pd.DataFrame())
+        results = _analyze_pile(db_pile, temp_df, daily_stats, forecast, asset_attrs.get("Rule_set"))
+
+        post_success = await client.post_recommendation_to_tb(asset_id, results)
+        msg = "✅ Sent Recommendation" if post_success else "❌ Recommendation not sent"
+        logging.info(f"{msg}: asset {asset_id}")
+        return post_success
+
+
+def create_recommendation_for_pile_async(asset_id):
+    """
+    Same pipeline as `create_recommendation_for_pile`, with the independent
+    ThingsBoard, Farm Calendar and weather calls gathered concurrently, so a
+    run takes about as long as its slowest call instead of their sum.
+    """
+    logging.info(f"🔁 Running async recommendation analysis for ThingsBoard Compost Pile: {asset_id}")
+    try:
+        return asyncio.run(_create_recommendation_for_pile_async(asset_id))
+    except Exception as e:
+        logging.error(f"Error processing asset {asset_id}: {e}")
+        logging.exception(e)
+        return False
 
 # TODO: If the Datasource pattern is applied, then this job may be merged with the above one.
+def _dk_start_date(attributes) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(attributes.get("start_date", 0) / 1000)
+
+
+def prefetch_dk_piles(workspaces: Dict[str, Dict]):
+    """Fetch the telemetry of many Datacake piles, keyed by workspace id, in batched requests."""
+    dk.prefetch_pile_telemetry({
+        workspace_id: store.datacake_history_start(workspace_id, _dk_start_date(attributes))
+        for workspace_id, attributes in workspaces.items()})
+
+
 def create_recommendation_for_dk_pile(workspace_id, attributes):
     logging.info(f"🔁 Running recommendation analysis for Datacake Compost Pile: {workspace_id}")
 
     try:
+        # Farm Calendar token shared by the observations and the forecast of this run
+        fc_token = fc.login_to_fc()
+
         workspace_name = dk.get_workspace_name_by_id(workspace_id)
         workspace_name = workspace_name if workspace_name else 'anonymous'
 
@@ -150,7 +300,7 @@ def create_recommendation_for_dk_pile(workspace_id, attributes):
                 pile = CompostPileCreate(
                     name=workspace_name,
                     ext_id=workspace_id,
-                    start_date=datetime.datetime.fromtimestamp(attributes.get("start_date", 0) / 1000),
+                    start_date=_dk_start_date(attributes),
                     greens=attributes.get("greens", 0),
                     browns=attributes.get("browns", 0),
                     latitude=float(attributes.get("latitude")),
@@ -162,12 +312,12 @@ def create_recommendation_for_dk_pile(workspace_id, attributes):
         # fields = ["SOIL_TEMPERATURE", "SOIL_MOISTURE", "SOIL_CONDUCTIVITY", "SOIL_PH"]
         temperature_device = ('', '')
 
-        # Fetch telemetry history
-        last_day_telemetry_data = dk.get_telemetry_for_workspace_devices(workspace_id)
-        devices_data = last_day_telemetry_data.get("data", {}).get("allDevices", [])
+        # Fetch the daily window of all devices and the temperature delta in one request
+        history_start = store.datacake_history_start(workspace_id, db_pile.start_date)
+        devices_data = dk.get_pile_telemetry(workspace_id, history_start)
         if not devices_data:
             logging.warning("No device telemetry found.")
-            return
+            return False
 
         daily_stats = {}
 
@@ -178,59 +328,27 @@ def create_recommendation_for_dk_pile(workspace_id, attributes):
                 continue
             if any('TEMP' in s for s in settings.DATACAKE_DEVICES[device_name]):
                 temperature_device = (device_id, device_name)
+                temperature_field = [k for k in settings.DATACAKE_DEVICES[device_name] if 'TEMP' in k]
+                store.store_datacake_history(db_pile.id, device_id, temperature_field, device.get("temperature")) # type: ignore [reportArgumentType]
 
             try:
-                history = json.loads(device["history"])
-                if not history:
+                history = dk.decode_history(device["history"], settings.DATACAKE_DEVICES[device_name])
+                if not len(history):
                     continue
 
-                df = pd.DataFrame(history)
-                df["time"] = pd.to_datetime(df["time"])
-
                 # Collect stats for all numeric fields
-                for col in df.columns:
-                    if col == "time" or col not in settings.DATACAKE_DEVICES[device_name]:
-                        continue
-                    values = df[col].dropna()
+                for col, values in history.values.items():
+                    field = col
+                    stats = StatsAccumulator.from_array(values)
                     try:
-                        values = values.astype(float)
-                        if not values.empty:
-                            # Rename columns
-                            if 'temp' in col.lower():
-                                col = 'temperature'
-                            if 'moisture' in col.lower():
-                                col = 'moisture'
-                            if 'ph' in col.lower():
-                                col = 'ph'
-
-                            daily_stats[col] = {
-                                'min': np.min(values),
-                                'max': np.max(values),
-                                'avg': np.mean(values),
-                                'std': np.std(values)
-                            }
+                        if stats.count:
+                            col = store.variable_name(col) or col
+
+                            daily_stats[col] = stats.as_dict()
+                            _save_daily_stats(db_pile, device_id, field, stats)
 
                         if settings.FARM_CALENDAR_URL:
-                            observation_dict = utils.create_observation_payload(
-                                col, daily_stats[col]['min'],
-                                daily_stats[col]['max'], daily_stats[col]['avg'],
-                                db_pile.name, source='Datacake'
-                            )
-                            token = fc.login_to_fc()
-                            success = fc.post_observation_to_fc(FC_COMPOST_OPERATION_ID, observation_dict, token)
-                            msg = "✅ Sent Observation to Farm Calendar" if success else "❌ Observation not sent"
-                            logging.info(f"{msg}: compost operation id: {FC_COMPOST_OPERATION_ID}")
-
-                            if not success:
-                                obs = ObservationCreate(
-                                    device_id=device_id, device_name=device_name, pile_id=db_pile.id, # type: ignore [reportArgumentType]
-                                    fc_compost_operation_id=FC_COMPOST_OPERATION_ID, variable=col,
-                                    mean_value=daily_stats[col]['avg'],
-                                    min_value=daily_stats[col]['min'], max_value=daily_stats[col]['max'],
-                                    date=datetime.datetime.now(datetime.timezone.utc), sent=success
-                                )
-                                with get_db() as db_session:
-                                    obs = dao.create_observation(db_session, obs)
+                            _send_observation(db_pile, device_id, device_name, col, daily_stats[col], 'Datacake', fc_token)
                     except Exception as e:
                         logging.exception(e)
                         continue
@@ -241,40 +359,27 @@ def create_recommendation_for_dk_pile(workspace_id, attributes):
                 logging.warning(f"Failed to process device '{device_name}': {e}")
                 continue
 
-        # Get all device telemetry and convert to DataFrame
+        # Read the temperature history from the local store
         temperature_field = [k for k in settings.DATACAKE_DEVICES[temperature_device[1]] if 'TEMP' in k]
-        all_device_temperature_telemetry = dk.get_telemetry_for_device(temperature_device[0], temperature_field)
-        all_device_temperature_telemetry = all_device_temperature_telemetry.get('data', {}).get('device', {}).get('history')
-        history_list = json.loads(all_device_temperature_telemetry)
-        # Convert the list of dictionaries into a DataFrame
-        temp_df = pd.DataFrame(history_list)
-        temp_df['time'] = pd.to_datetime(temp_df['time'])
-        temp_df.set_index("time", inplace=True)
-        temp_df.sort_index(inplace=True)
-        temp_df[temperature_field] = temp_df[temperature_field].astype(float)
-        # Moving Average of Temperatures
-        window = 6 # Appox 2 hours
-        temp_df["temp_ma"] = temp_df[temperature_field].rolling(window=window, min_periods=1).mean()
+        temp_df = _load_temperature_history(db_pile, temperature_device[0], temperature_field[0])
 
         if temp_df.empty:
             logging.warning("No temperature data found across devices.")
-            return
+            return False
 
         # Get weather forecast
-        forecast = ws.get_24h_forecast(db_pile.latitude, db_pile.longitude, fc.login_to_fc())
+        forecast = ws.get_24h_forecast(db_pile.latitude, db_pile.longitude, fc_token)
 
         # Run your recommendation logic
-        results = analyze_compost_status(
-            temp_df, daily_stats,
-            db_pile.start_date, db_pile.greens, db_pile.browns, # type: ignore [reportArgumentType]
-            forecast["temperature"], forecast["humidity"], []
-        )
+        results = _analyze_pile(db_pile, temp_df, daily_stats, forecast, attributes.get("rule_set"))
 
         # Placeholder: implement your posting method for Datacake
         # post_to_datacake(device_id, results)
 
         logging.info("✅ Recommendation generated successfully")
+        return True
 
     except Exception as e:
         logging.error(f"Error processing Datacake device: {e}")
         logging.exception(e)
+        return False
@@ -0,0 +1,132 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import requests
+
+from app.config import settings
+from app import utils
+from app.db.database import get_db
+import app.db.crud as dao
+from app.services import farm_calendar as fc
+
+
+# Client errors that say nothing about the observation itself
+_TRANSIENT_STATUS = {401, 403, 408, 425, 429}
+
+
+@dataclass
+class _Pending:
+    obs_id: int
+    compost_operation_id: str
+    payload: Dict
+
+
+def _pending(batch, token, rejected: Dict[int, str]) -> List[_Pending]:
+    """The observations of a page ready to post. Those without a valid payload go to `rejected`."""
+    pending = []
+    for obs, pile_name in batch:
+        compost_operation_id = obs.fc_compost_operation_id
+        if not compost_operation_id and pile_name:
+            # Queued before its pile had a compost operation in Farm Calendar
+            compost = fc.compost_operations.get(pile_name, token)
+            compost_operation_id = fc.compost_operation_id(compost) if compost else None
+        if not compost_operation_id:
+            continue
+        try:
+            payload = utils.create_observation_payload(
+                obs.variable, obs.min_value, obs.max_value, obs.mean_value,
+                pile_name, source=obs.source or obs.device_name,
+                phenomenon_time=obs.date)
+        except ValueError as e:
+            logging.warning(f"Skipping observation {obs.id}: {e}")
+            rejected[obs.id] = str(e)
+            continue
+        pending.append(_Pending(obs.id, compost_operation_id, payload))
+    return pending
+
+
+def _is_permanent(error: requests.exceptions.RequestException) -> bool:
+    """A 4xx answer rejects the observation itself; 5xx answers and network errors may pass later."""
+    status = error.response.status_code if error.response is not None else None
+    return status is not None and 400 <= status < 500 and status not in _TRANSIENT_STATUS
+
+
+def _post_with_backoff(item: _Pending, token, retries: int, backoff: float) -> Optional[Tuple[str, bool]]:
+    """None once posted, else the last error and whether retrying is pointless."""
+    error = ""
+    for attempt in range(retries + 1):
+        try:
+            fc.send_observation(item.compost_operation_id, item.payload, token)
+            return None
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Failed to post observation {item.obs_id}: {e}")
+            if _is_permanent(e):
+                return str(e), True
+            error = str(e)
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+    return error, False
+
+
+def dispatch_observations(batch_size: Optional[int] = None, workers: Optional[int] = None) -> int:
+    """
+    Post the observations left unsent to Farm Calendar.
+
+    The outbox is read in pages by id, each in its own short session, the
+    observations of a page are posted concurrently without any transaction
+    open, and the posted ones are marked with a single UPDATE. Failed ones
+    keep their error and count an attempt, and are parked once they reach
+    FC_OUTBOX_MAX_ATTEMPTS, right away when Farm Calendar rejects them with a
+    4xx, so they never hold back the rest of the outbox. A page where nothing
+    could be posted and every error was transient ends the run, as Farm
+    Calendar is likely down. Returns the number of observations sent.
+    """
+    batch_size = batch_size or settings.FC_OUTBOX_BATCH_SIZE
+    workers = workers or settings.FC_OUTBOX_WORKERS
+    max_attempts = settings.FC_OUTBOX_MAX_ATTEMPTS
+    token = None
+    after_id, sent = 0, 0
+
+    while True:
+        with get_db() as db:
+            batch = dao.get_unsent_observations_after(db, after_id, batch_size, max_attempts)
+        if not batch:
+            break
+        after_id = batch[-1][0].id
+
+        token = token or fc.login_to_fc()
+        if not token:
+            break
+        rejected: Dict[int, str] = {}
+        try:
+            pending = _pending(batch, token, rejected)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching compost operations: {e}")
+            break
+        results = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="fc-outbox") as executor:
+                results = list(executor.map(
+                    lambda item: _post_with_backoff(item, token, settings.FC_OUTBOX_RETRIES, settings.FC_OUTBOX_BACKOFF),
+                    pending))
+
+        posted = [item.obs_id for item, failure in zip(pending, results) if failure is None]
+        failed = {item.obs_id: failure for item, failure in zip(pending, results) if failure is not None}
+        errors = {**rejected, **{obs_id: error for obs_id, (error, _) in failed.items()}}
+        parked = list(rejected) + [obs_id for obs_id, (_, permanent) in failed.items() if permanent]
+        with get_db() as db:
+            sent += dao.mark_observations_as_sent(db, posted)
+            if errors:
+                parked_now = dao.record_observation_failures(db, errors, parked, max_attempts)
+                if parked_now:
+                    logging.warning(f"Parked {parked_now} observations Farm Calendar keeps rejecting")
+        if failed and not posted and not any(permanent for _, permanent in failed.values()):
+            logging.warning("Farm Calendar is not accepting observations, leaving the outbox for the next run")
+            break
+
+    if sent:
+        logging.info(f"📤 Sent {sent} queued observations to Farm Calendar")
+    return sent
@@ -2,21 +2,68 @@ import datetime
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from app.scheduler.jobs import create_recommendation_for_pile, create_recommendation_for_dk_pile
+from app.config import settings
+from app.scheduler.fleet import Fleet
+from app.scheduler.outbox import dispatch_observations
+from app.scheduler.jobs import create_recommendation_for_pile, create_recommendation_for_pile_async, create_recommendation_for_dk_pile, prefetch_dk_piles
+from app.services.thingsboard_stream import stream
+from app.services.recommendation_rules import rule_sets
 
 scheduler = BackgroundScheduler()
 
 running_job_ids = set()
 
-def schedule_tb_pile_monitor_job(asset_id):
+# Assets run by the single fleet job when SCHEDULER_MODE is "fleet"
+fleet = Fleet()
+FLEET_JOB_ID = "job_fleet"
+OUTBOX_JOB_ID = "job_fc_outbox"
+
+
+def run_fleet_job():
+    # Batched Datacake requests for the telemetry of all workspaces
+    dk_assets = fleet.assets(create_recommendation_for_dk_pile)
+    if dk_assets:
+        try:
+            prefetch_dk_piles({a.asset_id: a.args[1] for a in dk_assets})
+        except Exception as e:
+            logging.warning(f"Datacake prefetch failed, workspaces will be fetched one by one: {e}")
+    return fleet.run(workers=settings.FLEET_WORKERS)
+
+
+def _ensure_fleet_job():
+    if scheduler.get_job(FLEET_JOB_ID):
+        return
+    scheduler.add_job(
+        func=run_fleet_job,
+        trigger='cron',
+        hour=settings.FLEET_HOUR,
+        minute=settings.FLEET_MINUTE,
+        id=FLEET_JOB_ID,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    logging.info(f"📆 Scheduled daily fleet job at {settings.FLEET_HOUR:02d}.{settings.FLEET_MINUTE:02d}.")
+
+
+def _schedule_pile_monitor_job(asset_id, func, args):
     job_id = f"job_{asset_id}"
+    if settings.SCHEDULER_MODE == "fleet":
+        fleet.add(asset_id, func, args)
+        _ensure_fleet_job()
+        # First run right away, later runs go through the fleet job
+        scheduler.add_job(func=func, id=job_id, args=args, replace_existing=True)
+        running_job_ids.add(job_id)
+        logging.info(f"📆 Added {asset_id} to the daily fleet job.")
+        return job_id
+
     scheduler.add_job(
-        func=create_recommendation_for_pile,
+        func=func,
         trigger='cron',
         hour=23,
         minute=0,
         id=job_id,
-        args=[asset_id],
+        args=args,
         next_run_time=datetime.datetime.now(),
         replace_existing=True
     )
@@ -25,6 +72,11 @@ def schedule_tb_pile_monitor_job(asset_id):
     return job_id
 
 
+def schedule_tb_pile_monitor_job(asset_id):
+    func = create_recommendation_for_pile_async if settings.THINGSBOARD_ASYNC_JOBS else create_recommendation_for_pile
+    return _schedule_pile_monitor_job(asset_id, func, [asset_id])
+
+
 def remove_running_job(asset_id):
         job_id = f"job_{asset_id}"
         logging.info(f"Cancelling job...")
@@ -32,28 +84,30 @@ def remove_running_job(asset_id):
             logging.error(f"Could not cancel job with id: {job_id}")
             raise Exception(f"Could not cancel job with id: {job_id}")
 
-        scheduler.remove_job(job_id)
+        fleet.remove(asset_id)
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
         logging.info(f"Removed job with id: {job_id}")
         running_job_ids.remove(job_id)
         return job_id
 
 def schedule_dk_pile_monitor_job(workspace_id, attributes):
-    job_id = f"job_{workspace_id}"
-    scheduler.add_job(
-        func=create_recommendation_for_dk_pile,
-        trigger='cron',
-        hour=23,
-        minute=0,
-        id=job_id,
-        args=[workspace_id, attributes],
-        next_run_time=datetime.datetime.now(),
-        replace_existing=True
-    )
-    running_job_ids.add(job_id)
-    logging.info(f"📆 Scheduled daily job: {job_id} for recommendations at 23.00.")
-    return job_id
+    return _schedule_pile_monitor_job(workspace_id, create_recommendation_for_dk_pile, [workspace_id, attributes])
 
 
 
 def start_scheduler(app):
-    scheduler.start()
\ No newline at end of file
+    # Compile the default rule set up front, so a broken one fails at startup
+    rule_sets.get()
+    scheduler.add_job(
+        func=dispatch_observations,
+        trigger='interval',
+        minutes=settings.FC_OUTBOX_INTERVAL_MINUTES,
+        id=OUTBOX_JOB_ID,
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    scheduler.start()
+    if settings.THINGSBOARD_STREAMING:
+        stream.start()
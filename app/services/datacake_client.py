@@ -1,65 +1,281 @@
+import array
+import datetime
 import json
-from typing import Dict, List
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
 import requests
 
 from app.config import settings
+from app.services import upstreams
 
+DATACAKE_TIME_FORMAT = "%Y-%m-%dT%H:%M"
+DEFAULT_RESOLUTION = "60m"
 
-def get_devices_in_workspace(workspace_id):
-    query = '''
-        query {
-            allDevices(inWorkspace: "%s") {
-                id
-                verboseName
-            }
-        }
-        ''' % workspace_id
+# Declared types of the query variables. Non-null variables are also valid
+# where the schema takes nullable arguments.
+ID_TYPE = "String!"
+FIELDS_TYPE = "[String!]!"
+TIME_TYPE = "String!"
 
-    headers = {"Authorization": f"Token {settings.DATACAKE_API_KEY}", "Content-Type": "application/json"}
-    response = requests.post(f"{settings.DATACAKE_URL}", json={"query": query}, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    return data
 
-def get_telemetry_for_device(device_id, fields=[]):
-    query = f"""
-        query {{
-            device(deviceId: "{device_id}") {{
-                history(
-                fields: {json.dumps(fields)},
-                timerangestart:"2025-06-22T00:00",
-                timerangeend:"2025-06-23T00:00",
-                resolution:"60m"
-                )
-            }}
-        }}
-        """
+def _post_query(query, variables: Optional[Dict] = None):
     headers = {"Authorization": f"Token {settings.DATACAKE_API_KEY}", "Content-Type": "application/json"}
-    response = requests.post(f"{settings.DATACAKE_URL}", json={"query": query}, headers=headers)
+    with upstreams.limit(upstreams.DATACAKE):
+        response = requests.post(f"{settings.DATACAKE_URL}", json={"query": query, "variables": variables or {}}, headers=headers)
     response.raise_for_status()
     data = response.json()
+    if data.get("errors"):
+        logging.error(f"Datacake query errors: {data['errors']}")
     return data
 
-def get_telemetry_for_workspace_devices(workspace_id, fields=[]):
-    query = f"""
-        query {{
-            allDevices(inWorkspace: "{workspace_id}") {{
+
+def format_time(value) -> str:
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime(DATACAKE_TIME_FORMAT)
+
+
+def time_range(run_date: Optional[datetime.date] = None,
+               watermark_ms: Optional[int] = None) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    History window of a run: the whole UTC day of `run_date` (today by default),
+    or everything from the watermark up to the end of that day.
+    """
+    run_date = run_date or datetime.datetime.now(datetime.timezone.utc).date()
+    start = datetime.datetime.combine(run_date, datetime.time.min, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=1)
+    if watermark_ms is not None:
+        start = datetime.datetime.fromtimestamp(watermark_ms / 1000, datetime.timezone.utc)
+    return start, end
+
+
+@dataclass
+class HistoryColumns:
+    """A Datacake history as columns: epoch milliseconds and one float array per field."""
+    ts: np.ndarray
+    values: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame({"time": pd.to_datetime(self.ts, unit="ms", utc=True), **self.values})
+
+
+def _to_float(value) -> float:
+    if value is None or isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def decode_history(history, fields: List[str]) -> HistoryColumns:
+    """
+    Decode a `history` (the JSON string returned by the API, or its decoded
+    list) straight into columns of the given fields. Records are consumed as
+    the decoder produces them, so no list of dicts is ever built and every
+    other field is dropped on the spot. Only the items of the top-level list
+    are records; nested objects are values like any other. Missing or
+    non-numeric values are NaN.
+    """
+    index = {f: i for i, f in enumerate(fields)}
+    times: List[str] = []
+    columns = [array.array("d") for _ in fields]
+
+    def add_record(pairs) -> Tuple[int]:
+        row = [math.nan] * len(fields)
+        time_ = None
+        for key, value in pairs:
+            if key == "time":
+                time_ = value
+            elif key in index:
+                row[index[key]] = _to_float(value)
+        if time_ is None:
+            return (-1,)
+        times.append(time_)
+        for column, value in zip(columns, row):
+            column.append(value)
+        return (len(times) - 1,)
+
+    if isinstance(history, (str, bytes)):
+        # The hook also sees nested objects, innermost first. JSON decodes no
+        # tuples, so the rows of the records are those of the top-level tuples.
+        items = json.loads(history or "[]", object_pairs_hook=add_record)
+        records = [item[0] for item in items if isinstance(item, tuple) and item[0] >= 0] if isinstance(items, list) else []
+    else:
+        records = [add_record(record.items())[0] for record in history or [] if isinstance(record, dict)]
+        records = [i for i in records if i >= 0]
+
+    values = {f: np.frombuffer(c, dtype=np.float64) for f, c in zip(fields, columns)}
+    if len(records) < len(times):
+        times = [times[i] for i in records]
+        values = {f: v[records] for f, v in values.items()}
+    ts = pd.to_datetime(times, utc=True, format="ISO8601").as_unit("ms").asi8 if times else np.empty(0, dtype=np.int64)
+    return HistoryColumns(ts, values)
+
+
+@dataclass
+class History:
+    fields: List[str]
+    start: datetime.datetime
+    end: datetime.datetime
+    resolution: str = DEFAULT_RESOLUTION
+
+
+@dataclass
+class HistoryQuery:
+    """
+    Builder of a single GraphQL request for the history of many workspaces and devices.
+
+    Every workspace or device selection gets its own alias, and so does every
+    `history` field below it, so different windows or resolutions can share one
+    request. All arguments are sent as variables.
+
+        query = HistoryQuery()
+        query.add_workspace("w0", workspace_id, {"history": History(fields, start, end)})
+        devices = query.execute()["w0"]
+    """
+    selections: List[str] = field(default_factory=list)
+    declarations: List[str] = field(default_factory=list)
+    variables: Dict = field(default_factory=dict)
+
+    def _var(self, name, type_, value) -> str:
+        self.declarations.append(f"${name}: {type_}")
+        self.variables[name] = value
+        return f"${name}"
+
+    def _histories(self, alias, histories: Dict[str, History]) -> str:
+        return "\n".join(
+            f"{h_alias}: history("
+            f"fields: {self._var(f'{alias}_{h_alias}_fields', FIELDS_TYPE, list(h.fields))}, "
+            f"timerangestart: {self._var(f'{alias}_{h_alias}_start', TIME_TYPE, format_time(h.start))}, "
+            f"timerangeend: {self._var(f'{alias}_{h_alias}_end', TIME_TYPE, format_time(h.end))}, "
+            f"resolution: {self._var(f'{alias}_{h_alias}_resolution', TIME_TYPE, h.resolution)})"
+            for h_alias, h in histories.items())
+
+    def add_workspace(self, alias, workspace_id, histories: Dict[str, History]):
+        self.selections.append(
+            f"{alias}: allDevices(inWorkspace: {self._var(f'{alias}_id', ID_TYPE, workspace_id)}) {{\n"
+            f"id\nverboseName\n{self._histories(alias, histories)}\n}}")
+        return self
+
+    def add_device(self, alias, device_id, histories: Dict[str, History]):
+        self.selections.append(
+            f"{alias}: device(deviceId: {self._var(f'{alias}_id', ID_TYPE, device_id)}) {{\n"
+            f"id\n{self._histories(alias, histories)}\n}}")
+        return self
+
+    def build(self) -> Tuple[str, Dict]:
+        declarations = f"({', '.join(self.declarations)})" if self.declarations else ""
+        return f"query DatacakeHistory{declarations} {{\n" + "\n".join(self.selections) + "\n}", self.variables
+
+    def execute(self) -> Dict:
+        return _post_query(*self.build()).get("data") or {}
+
+
+def get_devices_in_workspace(workspace_id):
+    query = '''
+        query DevicesInWorkspace($workspace: %s) {
+            allDevices(inWorkspace: $workspace) {
                 id
                 verboseName
-                history(
-                fields: {json.dumps(fields)},
-                timerangestart:"2025-06-22T00:00",
-                timerangeend:"2025-06-23T00:00",
-                resolution:"60m"
-                )
-            }}
-        }}
-        """
-    headers = {"Authorization": f"Token {settings.DATACAKE_API_KEY}", "Content-Type": "application/json"}
-    response = requests.post(f"{settings.DATACAKE_URL}", json={"query": query}, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    return data
+            }
+        }
+        ''' % ID_TYPE
+
+    return _post_query(query, {"workspace": workspace_id})
+
+def get_telemetry_for_device(device_id, fields=[], timerangestart=None, timerangeend=None, resolution=DEFAULT_RESOLUTION):
+    start, end = time_range()
+    history = History(fields, timerangestart or start, timerangeend or end, resolution)
+    return {"data": HistoryQuery().add_device("device", device_id, {"history": history}).execute()}
+
+def get_telemetry_for_workspace_devices(workspace_id, fields=[], run_date: Optional[datetime.date] = None,
+                                        watermark_ms: Optional[int] = None):
+    history = History(fields, *time_range(run_date, watermark_ms))
+    return {"data": HistoryQuery().add_workspace("allDevices", workspace_id, {"history": history}).execute()}
+
+def _query_workspaces(histories: Dict[str, Dict[str, History]]) -> Dict[str, List[Dict]]:
+    """Devices of many workspaces with the given histories, DATACAKE_BATCH_SIZE workspaces per request."""
+    workspace_ids = list(histories)
+    devices: Dict[str, List[Dict]] = {}
+    for i in range(0, len(workspace_ids), settings.DATACAKE_BATCH_SIZE):
+        batch = workspace_ids[i:i + settings.DATACAKE_BATCH_SIZE]
+        query = HistoryQuery()
+        for n, workspace_id in enumerate(batch):
+            query.add_workspace(f"w{n}", workspace_id, histories[workspace_id])
+        data = query.execute()
+        for n, workspace_id in enumerate(batch):
+            devices[workspace_id] = data.get(f"w{n}") or []
+    return devices
+
+
+def temperature_fields() -> List[str]:
+    return [f for fields in settings.DATACAKE_DEVICES.values() for f in fields if 'TEMP' in f]
+
+def _pile_histories(history_start: datetime.datetime, run_date: Optional[datetime.date]) -> Dict[str, History]:
+    start, end = time_range(run_date)
+    return {
+        "history": History([], start, end),
+        "temperature": History(temperature_fields(), history_start, end, settings.DATACAKE_HISTORY_RESOLUTION)
+    }
+
+def get_pile_telemetry(workspace_id, history_start: datetime.datetime,
+                       run_date: Optional[datetime.date] = None) -> List[Dict]:
+    """
+    Everything a pile run needs in one request: every device of the workspace
+    with the daily window of all its fields as `history`, and the temperature
+    fields since `history_start` as `temperature`.
+    """
+    prefetched = _pop_prefetched(workspace_id, history_start, run_date)
+    if prefetched is not None:
+        return prefetched
+    query = HistoryQuery().add_workspace("allDevices", workspace_id, _pile_histories(history_start, run_date))
+    return query.execute().get("allDevices") or []
+
+def get_pile_telemetry_for_workspaces(history_starts: Dict[str, datetime.datetime],
+                                      run_date: Optional[datetime.date] = None) -> Dict[str, List[Dict]]:
+    return _query_workspaces({
+        workspace_id: _pile_histories(history_start, run_date)
+        for workspace_id, history_start in history_starts.items()})
+
+
+# Pile telemetry fetched in batches ahead of the jobs that consume it
+_prefetched: Dict[Tuple[str, datetime.date], Tuple[datetime.datetime, List[Dict]]] = {}
+_prefetched_lock = threading.Lock()
+
+def prefetch_pile_telemetry(history_starts: Dict[str, datetime.datetime], run_date: Optional[datetime.date] = None):
+    run_date = run_date or datetime.datetime.now(datetime.timezone.utc).date()
+    devices = get_pile_telemetry_for_workspaces(history_starts, run_date)
+    with _prefetched_lock:
+        _evict_prefetched(run_date)
+        for workspace_id, workspace_devices in devices.items():
+            _prefetched[(workspace_id, run_date)] = (history_starts[workspace_id], workspace_devices)
+    logging.info(f"Prefetched Datacake telemetry of {len(devices)} workspaces")
+
+def _evict_prefetched(run_date: datetime.date):
+    """Drop the prefetches of earlier runs that failed or skipped jobs never took. Call with the lock held."""
+    for key in [key for key in _prefetched if key[1] < run_date]:
+        del _prefetched[key]
+
+def _pop_prefetched(workspace_id, history_start, run_date) -> Optional[List[Dict]]:
+    run_date = run_date or datetime.datetime.now(datetime.timezone.utc).date()
+    with _prefetched_lock:
+        prefetched = _prefetched.pop((workspace_id, run_date), None)
+    # Only usable if the store has not moved since the prefetch
+    if prefetched is None or prefetched[0] != history_start:
+        return None
+    return prefetched[1]
 
 def get_all_workspaces():
     query = """
@@ -70,13 +286,18 @@ def get_all_workspaces():
         }
         }
         """
-    headers = {"Authorization": f"Token {settings.DATACAKE_API_KEY}", "Content-Type": "application/json"}
-    response = requests.post(f"{settings.DATACAKE_URL}", json={"query": query}, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    return data
+    return _post_query(query)
 
-def get_workspace_name_by_id(workspace_id):
+
+# Workspace names, refreshed every DATACAKE_WORKSPACE_NAMES_TTL seconds,
+# or sooner when asked for a workspace created since the last refresh
+WORKSPACE_NAMES_MISS_REFRESH = 60
+_workspace_names: Dict[str, str] = {}
+_workspace_names_loaded_at: Optional[float] = None
+_workspace_names_lock = threading.Lock()
+
+def _load_workspace_names():
+    global _workspace_names, _workspace_names_loaded_at
     data = get_all_workspaces()
     if 'data' not in data or not isinstance(data['data'], dict):
         raise Exception("Warning: 'data' key not found or not a dictionary in the input.")
@@ -84,12 +305,14 @@ def get_workspace_name_by_id(workspace_id):
         raise Exception("Warning: 'allWorkspaces' key not found or not a list within 'data'.")
 
     workspaces: List[Dict[str, str]] = data['data']['allWorkspaces']
-    for workspace in workspaces:
-        if 'id' in workspace and 'name' in workspace:
-            if workspace['id'] == workspace_id:
-                return workspace['name']
-
-    # If the loop completes, the ID was not found
-    return None
-
+    _workspace_names = {w['id']: w['name'] for w in workspaces if 'id' in w and 'name' in w}
+    _workspace_names_loaded_at = time.monotonic()
 
+def get_workspace_name_by_id(workspace_id):
+    with _workspace_names_lock:
+        age = None if _workspace_names_loaded_at is None else time.monotonic() - _workspace_names_loaded_at
+        if age is None or age > settings.DATACAKE_WORKSPACE_NAMES_TTL or \
+                (workspace_id not in _workspace_names and age > WORKSPACE_NAMES_MISS_REFRESH):
+            _load_workspace_names()
+        # None if the ID was not found
+        return _workspace_names.get(workspace_id)
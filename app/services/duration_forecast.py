@@ -0,0 +1,273 @@
+# Probabilistic remaining duration of piles, simulated as many scenarios at once
+import datetime
+import hashlib
+import logging
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.db.database import get_db
+import app.db.crud as dao
+from app.db.models import CompostPile
+from app.services import telemetry_store as store
+from app.services import weather
+from app.services.pile_monitor import base_speed_factors, calculate_cn_ratios, humidity_factors, temp_factors
+from app.services.stats import DAY_MS
+
+BASE_DAYS = 90  # Full cycle at a speed factor of 1, as `estimate_total_duration_static`
+MATERIAL_SIGMA = 0.2  # Lognormal spread of the weighed greens and browns
+CN_GREENS = (10, 20)  # Range of the C:N ratio of greens, 15 in the static estimate
+CN_BROWNS = (40, 80)  # Range of the C:N ratio of browns, 60 in the static estimate
+RECENT_DAYS = 7  # Measured days the future conditions are drawn around
+TEMPERATURE_SIGMA = 3.0  # Spread of the future pile temperature when the recent days do not tell
+MOISTURE_SIGMA = 5.0
+AMBIENT_COUPLING = 0.3  # Change of pile temperature per degree of ambient temperature change
+PILE_CHUNK = 200  # Piles simulated together, bounding the memory to PILE_CHUNK x scenarios x forecast days
+
+_EMPTY = np.empty(0)
+
+
+@dataclass
+class PileConditions:
+    """
+    What the simulation knows of a pile. The daily series start at the pile
+    start date, NaN for days without data; days past their end are unknown.
+    """
+    start_date: datetime.date
+    greens: float
+    browns: float
+    temperature: np.ndarray = field(default_factory=lambda: _EMPTY)  # Daily mean pile temperature
+    moisture: np.ndarray = field(default_factory=lambda: _EMPTY)  # Daily mean pile moisture
+    ambient_forecast: np.ndarray = field(default_factory=lambda: _EMPTY)  # Daily mean ambient temperature from today
+
+    def fingerprint(self, today: datetime.date) -> str:
+        digest = hashlib.sha1(repr((today, self.start_date, self.greens, self.browns, settings.DURATION_SCENARIOS,
+                                    settings.DURATION_HORIZON_DAYS, settings.DURATION_SEED,
+                                    tuple(settings.DURATION_PERCENTILES))).encode())
+        for values in (self.temperature, self.moisture, self.ambient_forecast):
+            digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes() + b"|")
+        return digest.hexdigest()
+
+
+@dataclass
+class DurationForecast:
+    """Remaining days and completion dates at the requested percentiles, None beyond the horizon."""
+    percentiles: Tuple[float, ...]
+    remaining_days: Tuple[Optional[int], ...]
+    completion_dates: Tuple[Optional[datetime.date], ...]
+
+    def as_dict(self) -> Dict[str, Optional[str]]:
+        return {
+            f"estimated_completion_p{p:g}": d.isoformat() if d else None
+            for p, d in zip(self.percentiles, self.completion_dates)
+        }
+
+
+def _measured(values: np.ndarray, elapsed: int) -> np.ndarray:
+    """The elapsed days of a daily series, NaN where unknown."""
+    out = np.full(max(elapsed, 0), np.nan)
+    n = min(len(values), len(out))
+    out[:n] = values[:n]
+    return out
+
+
+def _recent_level(values: np.ndarray, default_sigma: float) -> Tuple[float, float]:
+    recent = values[~np.isnan(values)][-RECENT_DAYS:]
+    if not len(recent):
+        return math.nan, default_sigma
+    return float(recent.mean()), float(recent.std()) if len(recent) > 2 else default_sigma
+
+
+def _scenario_draws(streams: Sequence[int], scenarios: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Standard uniforms (2, piles, scenarios) and normals (4, piles, scenarios)
+    of every pile, each from its own random stream of DURATION_SEED, so a
+    pile gets the same draws alone as within any batch.
+    """
+    uniforms = np.empty((2, len(streams), scenarios))
+    normals = np.empty((4, len(streams), scenarios))
+    for i, stream in enumerate(streams):
+        rng = np.random.default_rng(np.random.SeedSequence(settings.DURATION_SEED, spawn_key=(int(stream),)))
+        uniforms[:, i] = rng.random((2, scenarios))
+        normals[:, i] = rng.standard_normal((4, scenarios))
+    return uniforms, normals
+
+
+def simulate_remaining_days(piles: Sequence[PileConditions], today: Optional[datetime.date] = None,
+                            scenarios: Optional[int] = None, streams: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    Remaining days of every scenario of every pile, shaped (piles, scenarios),
+    inf beyond the horizon.
+
+    A day advances a pile by its C:N speed factor times the temperature and
+    moisture factors of that day, and the pile is done after BASE_DAYS of
+    progress at factor 1. The measured days give the progress so far, days
+    without data count at factor 1 as the static estimate assumes. Each
+    scenario draws the material weights and C:N ratios, and the pile
+    temperature and moisture levels around the recent days. Over the
+    forecast days the temperature follows the ambient forecast, then stays
+    at the drawn level. All piles and scenarios are evaluated in one pass.
+    `streams` are the random streams of the piles, e.g. their ids, their
+    positions by default.
+    """
+    today = today or datetime.date.today()
+    scenarios = scenarios or settings.DURATION_SCENARIOS
+    n = len(piles)
+    if not n:
+        return np.empty((0, scenarios))
+
+    greens = np.array([p.greens for p in piles], dtype=float)[:, None]
+    browns = np.array([p.browns for p in piles], dtype=float)[:, None]
+    elapsed = [(today - p.start_date).days for p in piles]
+    progress = np.empty(n)
+    levels = np.empty((n, 4))
+    forecast_days = max(len(p.ambient_forecast) for p in piles)
+    ambient_change = np.zeros((n, forecast_days))
+    for i, (pile, days) in enumerate(zip(piles, elapsed)):
+        temperature = _measured(np.asarray(pile.temperature, dtype=float), days)
+        moisture = _measured(np.asarray(pile.moisture, dtype=float), days)
+        factors = (np.where(np.isnan(temperature), 1.0, temp_factors(temperature))
+                   * np.where(np.isnan(moisture), 1.0, humidity_factors(moisture)))
+        progress[i] = factors.sum()
+        levels[i] = _recent_level(temperature, TEMPERATURE_SIGMA) + _recent_level(moisture, MOISTURE_SIGMA)
+        ambient = np.asarray(pile.ambient_forecast, dtype=float)
+        if len(ambient):
+            ambient_change[i, :len(ambient)] = np.nan_to_num(ambient - ambient[0])
+
+    uniforms, normals = _scenario_draws(range(n) if streams is None else streams, scenarios)
+    speed = base_speed_factors(calculate_cn_ratios(
+        greens * np.exp(MATERIAL_SIGMA * normals[0]), browns * np.exp(MATERIAL_SIGMA * normals[1]),
+        CN_GREENS[0] + (CN_GREENS[1] - CN_GREENS[0]) * uniforms[0],
+        CN_BROWNS[0] + (CN_BROWNS[1] - CN_BROWNS[0]) * uniforms[1]))
+    temperature = levels[:, 0:1] + levels[:, 1:2] * normals[2]
+    moisture = np.clip(levels[:, 2:3] + levels[:, 3:4] * normals[3], 0, 100)
+    # Unknown conditions count at factor 1, as the static estimate
+    moisture_factor = np.where(np.isnan(moisture), 1.0, humidity_factors(moisture))
+    known_temperature = ~np.isnan(temperature)
+    rate = np.where(known_temperature, temp_factors(temperature), 1.0) * moisture_factor
+
+    # Whole days rounded half to even, as the static estimate
+    need = np.rint(BASE_DAYS / speed) - progress[:, None]
+    remaining = np.ceil(need / rate)
+    if forecast_days:
+        forecast_temperature = temperature[:, :, None] + AMBIENT_COUPLING * ambient_change[:, None, :]
+        forecast_rate = np.where(known_temperature[:, :, None], temp_factors(forecast_temperature), 1.0) \
+            * moisture_factor[:, :, None]
+        done = np.cumsum(forecast_rate, axis=2)
+        days_short = (done < need[:, :, None]).sum(axis=2)
+        after = forecast_days + np.ceil((need - done[:, :, -1]) / rate)
+        remaining = np.where(days_short < forecast_days, days_short + 1, after)
+    remaining = np.where(need <= 0, 0, remaining)
+    return np.where(remaining > settings.DURATION_HORIZON_DAYS, np.inf, remaining)
+
+
+def forecast_durations(piles: Sequence[PileConditions], today: Optional[datetime.date] = None,
+                       percentiles: Optional[Sequence[float]] = None,
+                       streams: Optional[Sequence[int]] = None) -> List[DurationForecast]:
+    """
+    Percentile completion dates of many piles, simulated in chunks. Each pile
+    draws from its own random stream (see `simulate_remaining_days`), so its
+    forecast does not depend on the other piles of the batch.
+    """
+    today = today or datetime.date.today()
+    percentiles = tuple(percentiles or settings.DURATION_PERCENTILES)
+    streams = list(range(len(piles)) if streams is None else streams)
+    forecasts = []
+    for start in range(0, len(piles), PILE_CHUNK):
+        remaining = simulate_remaining_days(piles[start:start + PILE_CHUNK], today,
+                                            streams=streams[start:start + PILE_CHUNK])
+        # inf sorts last, so a percentile beyond the horizon comes out inf
+        days = np.percentile(remaining, percentiles, axis=1, method="higher").T
+        for row in days:
+            known = [None if math.isinf(d) else int(d) for d in row]
+            forecasts.append(DurationForecast(
+                percentiles, tuple(known),
+                tuple(None if d is None else today + datetime.timedelta(days=d) for d in known)))
+    return forecasts
+
+
+class DurationForecastCache:
+    """Duration forecasts per pile, simulated again only when the pile conditions or the day change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._forecasts: Dict[int, Tuple[str, DurationForecast]] = {}
+
+    def get_many(self, piles: Mapping[int, PileConditions], today: Optional[datetime.date] = None) -> Dict[int, DurationForecast]:
+        today = today or datetime.date.today()
+        fingerprints = {pile_id: conditions.fingerprint(today) for pile_id, conditions in piles.items()}
+        with self._lock:
+            cached = {pile_id: self._forecasts.get(pile_id) for pile_id in piles}
+        results = {pile_id: c[1] for pile_id, c in cached.items() if c and c[0] == fingerprints[pile_id]}
+        stale = [pile_id for pile_id in piles if pile_id not in results]
+        if stale:
+            forecasts = forecast_durations([piles[pile_id] for pile_id in stale], today, streams=stale)
+            with self._lock:
+                for pile_id, forecast in zip(stale, forecasts):
+                    self._forecasts[pile_id] = (fingerprints[pile_id], forecast)
+            results.update(zip(stale, forecasts))
+        return results
+
+    def get(self, pile_id: int, conditions: PileConditions, today: Optional[datetime.date] = None) -> DurationForecast:
+        return self.get_many({pile_id: conditions}, today)[pile_id]
+
+
+def _daily_means(rows, start_day: int, days: int, matches) -> np.ndarray:
+    """Count weighted daily means over all devices of the stored stats of the matching keys."""
+    sums, counts = np.zeros(days), np.zeros(days)
+    for row in rows:
+        i = (row.day - start_day) // DAY_MS
+        if 0 <= i < days and matches(row.key.lower()):
+            sums[i] += row.mean * row.count
+            counts[i] += row.count
+    with np.errstate(invalid="ignore"):
+        return sums / counts
+
+
+def load_conditions(db_pile: CompostPile, today: Optional[datetime.date] = None) -> PileConditions:
+    """Pile conditions from the stored daily stats and ambient forecast, without any upstream call."""
+    today = today or datetime.date.today()
+    start_date = db_pile.start_date or today
+    if isinstance(start_date, datetime.datetime):
+        start_date = start_date.date()
+    start_day = int(datetime.datetime.combine(start_date, datetime.time.min, datetime.timezone.utc).timestamp() * 1000)
+    days = max((today - start_date).days, 0)
+    with get_db() as db:
+        rows = dao.get_pile_daily_stats(db, db_pile.id, start_day) # type: ignore [reportArgumentType]
+
+    today_ms = int(datetime.datetime.combine(today, datetime.time.min, datetime.timezone.utc).timestamp() * 1000)
+    ts, values = weather.get_ambient_series(db_pile.latitude, db_pile.longitude, "temperature", start=today_ms)
+    offsets = (ts - today_ms) // DAY_MS
+    with np.errstate(invalid="ignore"):
+        ambient = (np.bincount(offsets, weights=values) / np.bincount(offsets)) if len(ts) else _EMPTY
+
+    return PileConditions(
+        start_date=start_date,
+        greens=float(db_pile.greens or 0), # type: ignore [reportArgumentType]
+        browns=float(db_pile.browns or 0), # type: ignore [reportArgumentType]
+        temperature=_daily_means(rows, start_day, days, lambda key: store.variable_name(key) == "temperature"),
+        moisture=_daily_means(rows, start_day, days, lambda key: store.variable_name(key) == "moisture"),
+        ambient_forecast=ambient)
+
+
+def forecast_pile(db_pile: CompostPile, today: Optional[datetime.date] = None) -> DurationForecast:
+    return durations.get(db_pile.id, load_conditions(db_pile, today), today) # type: ignore [reportArgumentType]
+
+
+def forecast_fleet(db_piles: Sequence[CompostPile], today: Optional[datetime.date] = None) -> Dict[int, DurationForecast]:
+    """Forecasts of many piles, the stale ones simulated together."""
+    conditions = {}
+    for db_pile in db_piles:
+        try:
+            conditions[db_pile.id] = load_conditions(db_pile, today)
+        except Exception as e:
+            logging.error(f"Conditions of pile {db_pile.id} not loaded: {e}")
+    return durations.get_many(conditions, today)
+
+
+# Process-wide cache of the duration forecasts
+durations = DurationForecastCache()
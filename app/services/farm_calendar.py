@@ -1,70 +1,144 @@
 import requests
 import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urljoin
 
 from app.config import settings
+from app.services.gatekeeper import gatekeeper
 
-FC_LOGIN_URL = "https://gk.sip5.horizon-openagri.eu/api/login/"
+FC_LOGIN_URL = settings.FC_LOGIN_URL
 
 
-# Function to login to Farm Calendar API and get JWT token
+# Function to login to Farm Calendar API and get JWT token, reused until shortly before it expires
 def login_to_fc():
-    try:
-        response = requests.post(FC_LOGIN_URL, json={'username': settings.FC_USERNAME, 'password': settings.FC_PASSWORD})
-        response.raise_for_status()
-        token = response.json()["access"]
-        if not token:
-            logging.error("Login failed: No token returned.")
-            return None
-        logging.info("Logged in successfully to Farm Calendar")
-
-        return token
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error logging in to Farm Calendar: {e}")
-        return None
+    return gatekeeper.get_token()
 
-# Function to fetch the compost operation ID from Farm Calendar
-def get_compost_operation_details(pile_name, token):
-    headers = {"Authorization": f"Bearer {token}"}
-    compost_operations_url = f"{settings.FARM_CALENDAR_URL}/CompostOperations/"
-    try:
-        # Get the list of compost operations
-        response = requests.get(compost_operations_url, headers=headers)
-        response.raise_for_status()
-        compost_operations = response.json()
+def compost_pile_urn(pile_name) -> str:
+    return f"urn:farmcalendar:CompostPile:{pile_name}"
 
-        # Filter compost operations based on pile_name
-        for compost in compost_operations["@graph"]:
-            if "isOperatedOn" in compost and compost["isOperatedOn"].get("@id") == f"urn:farmcalendar:CompostPile:{pile_name}":
-                compost_id = compost["@id"].split(":")[-1]  # Extract the compost operation ID
-                logging.info(f"Found compost operation ID: {compost_id}")
-                start = compost.get("hasStartDatetime")
-                end = compost.get("hasEndDatetime")
 
-                if not start or not end:
-                    logging.warning(f"Missing start or end date for {pile_name}")
-                    return None
+def _next_page(response, body) -> Optional[str]:
+    """
+    Link to the next page, as a Link header, a hydra view or a plain `next`
+    field, resolved against the URL of the current page.
+    """
+    link = None
+    if "next" in response.links:
+        link = response.links["next"]["url"]
+    elif isinstance(body, dict):
+        view = body.get("hydra:view") or body.get("view") or {}
+        link = view.get("hydra:next") or view.get("next") or body.get("next")
+    return urljoin(response.url, link) if link else None
 
-                return (compost_id, start, end)
 
-        logging.warning(f"No compost operation found for pile {pile_name}")
-        return None
+class CompostOperationRegistry:
+    """
+    In-memory index of the Farm Calendar compost operations by the URN of the
+    pile they are operated on.
+
+    The whole list, over all of its pages, is downloaded at most once per
+    `ttl` seconds. After that the first page is requested again with the
+    validators of the last download, and a 304 keeps the index as it is.
+    Lookups between refreshes are dict reads.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self._ttl = ttl if ttl is not None else settings.FC_COMPOST_OPERATIONS_TTL
+        self._lock = threading.Lock()
+        self._by_pile: Dict[str, Dict] = {}
+        self._validators: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._validators = {}
+
+    def get(self, pile_name, token) -> Optional[Dict]:
+        """The compost operation of a pile, or None if it has none."""
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl:
+                self._refresh(token)
+            return self._by_pile.get(compost_pile_urn(pile_name))
+
+    def _refresh(self, token):
+        conditional = {}
+        if "ETag" in self._validators:
+            conditional["If-None-Match"] = self._validators["ETag"]
+        if "Last-Modified" in self._validators:
+            conditional["If-Modified-Since"] = self._validators["Last-Modified"]
+
+        url: Optional[str] = f"{settings.FARM_CALENDAR_URL}/CompostOperations/"
+        by_pile: Dict[str, Dict] = {}
+        validators: Dict[str, str] = {}
+        first = True
+        while url:
+            response = gatekeeper.request("GET", url, token, headers=conditional if first else None)
+            if first and response.status_code == 304:
+                self._loaded_at = time.monotonic()
+                return
+            response.raise_for_status()
+            if first:
+                validators = {h: response.headers[h] for h in ("ETag", "Last-Modified") if h in response.headers}
+            body = response.json()
+            for compost in (body.get("@graph", []) if isinstance(body, dict) else body):
+                pile = compost.get("isOperatedOn")
+                if isinstance(pile, dict) and pile.get("@id"):
+                    by_pile[pile["@id"]] = compost
+            url, first = _next_page(response, body), False
+
+        self._by_pile, self._validators = by_pile, validators
+        self._loaded_at = time.monotonic()
+        logging.info(f"Loaded {len(by_pile)} compost operations from Farm Calendar")
+
+
+compost_operations = CompostOperationRegistry()
+
+
+def compost_operation_id(compost) -> str:
+    return compost["@id"].split(":")[-1]
+
+
+# Function to fetch the compost operation ID from Farm Calendar
+def get_compost_operation_details(pile_name, token):
+    try:
+        compost = compost_operations.get(pile_name, token)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching compost operations: {e}")
         return None
 
+    if not compost:
+        logging.warning(f"No compost operation found for pile {pile_name}")
+        return None
+
+    compost_id = compost_operation_id(compost)  # Extract the compost operation ID
+    logging.info(f"Found compost operation ID: {compost_id}")
+    start = compost.get("hasStartDatetime")
+    end = compost.get("hasEndDatetime")
+
+    if not start or not end:
+        logging.warning(f"Missing start or end date for {pile_name}")
+        return None
+
+    return (compost_id, start, end)
+
+def send_observation(compost_operation_id, observation_data, token):
+    """Post an observation to its compost operation, raising any request error."""
+    url = f"{settings.FARM_CALENDAR_URL}/CompostOperations/{compost_operation_id}/Observations/"
+    response = gatekeeper.request("POST", url, token, json=observation_data)
+    response.raise_for_status()
+    logging.info(f"Successfully posted observation to {url}")
+
 # Function to post observation to the correct endpoint
 def post_observation_to_fc(compost_operation_id, observation_data, token):
     if not compost_operation_id:
         logging.warning("No compost operation ID available. Skipping post.")
         return False
 
-    url = f"{settings.FARM_CALENDAR_URL}/CompostOperations/{compost_operation_id}/Observations/"
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.post(url, json=observation_data, headers=headers)
-        response.raise_for_status()
-        logging.info(f"Successfully posted observation to {url}")
+        send_observation(compost_operation_id, observation_data, token)
         return True
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to post observation: {e}")
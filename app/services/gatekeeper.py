@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.config import settings
+from app.services import upstreams
+from app.utils import DEFAULT_TOKEN_TTL, decode_jwt_expiry
+
+
+class GatekeeperSession:
+    """
+    Process-wide session with the OpenAgri gatekeeper, whose access token is
+    accepted by both Farm Calendar and the weather service.
+
+    The access token is reused until `refresh_margin` seconds before its
+    `exp`. It is then renewed with the refresh token while that one is still
+    valid, and only otherwise with a password login. All requests go through
+    one pooled keep-alive HTTP session.
+    """
+
+    def __init__(self, refresh_margin: int = 60, pool_size: int = 10):
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._access: Optional[str] = None
+        self._access_expires_at = 0.0
+        self._refresh: Optional[str] = None
+        self._refresh_expires_at = 0.0
+
+    def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        with self._lock:
+            now = time.time()
+            if force_refresh or not self._access or now >= self._access_expires_at - self._refresh_margin:
+                tokens = None
+                if self._refresh and now < self._refresh_expires_at - self._refresh_margin:
+                    tokens = self._post(settings.FC_REFRESH_URL, {"refresh": self._refresh})
+                if not tokens:
+                    tokens = self._post(settings.FC_LOGIN_URL, {"username": settings.FC_USERNAME, "password": settings.FC_PASSWORD})
+                self._store(tokens or {})
+            return self._access
+
+    def invalidate(self, token: Optional[str] = None):
+        """Drop the cached access token, unless another thread already replaced it."""
+        with self._lock:
+            if token is None or token == self._access:
+                self._access = None
+                self._access_expires_at = 0.0
+
+    def _store(self, tokens):
+        self._access = tokens.get("access")
+        expiry = decode_jwt_expiry(self._access)
+        self._access_expires_at = expiry if expiry else time.time() + DEFAULT_TOKEN_TTL
+        # Refresh tokens may or may not be rotated
+        if tokens.get("refresh"):
+            self._refresh = tokens["refresh"]
+            self._refresh_expires_at = decode_jwt_expiry(self._refresh) or 0.0
+        elif not self._access:
+            self._refresh = None
+
+    def _post(self, url, payload) -> Optional[dict]:
+        try:
+            with upstreams.limit(upstreams.FARM_CALENDAR):
+                response = self.http.post(url, json=payload)
+            response.raise_for_status()
+            tokens = response.json()
+            if not tokens.get("access"):
+                logging.error("Login failed: No token returned.")
+                return None
+            logging.info("Logged in successfully to Farm Calendar")
+            return tokens
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error logging in to Farm Calendar: {e}")
+            return None
+
+    def request(self, method, url, token=None, upstream=upstreams.FARM_CALENDAR, headers=None, **kwargs) -> requests.Response:
+        """
+        Send a request authorized with `token`, or with the cached token if none
+        is given. A 401 answer drops the token and the request is retried once
+        with a fresh one.
+        """
+        response = None
+        for _ in range(2):
+            token = token or self.get_token()
+            if not token:
+                raise requests.exceptions.RequestException("Could not authenticate to the gatekeeper")
+            with upstreams.limit(upstream):
+                response = self.http.request(
+                    method, url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, **kwargs)
+            if response.status_code != 401:
+                break
+            logging.warning("Gatekeeper token rejected, logging in again")
+            self.invalidate(token)
+            token = None
+        return response # type: ignore [reportReturnType]
+
+
+# Shared by the Farm Calendar and weather clients
+gatekeeper = GatekeeperSession(refresh_margin=settings.FC_TOKEN_REFRESH_MARGIN, pool_size=settings.FC_POOL_SIZE)
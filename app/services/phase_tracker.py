@@ -0,0 +1,108 @@
+# Phase detector state per pile temperature series, persisted and advanced over new points only
+import logging
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.db.database import get_db
+import app.db.crud as dao
+from app.db.models import PhaseState
+from app.services.pile_monitor import PhaseStateMachine
+from app.services import preprocessing
+
+_FLAGS = ("thermophilic_started", "mesophilic_entered", "thermophilic_entered", "cooling_entered", "maturation_entered")
+_COUNTERS = ("thermophilic_days", "consecutive_above", "consecutive_below")
+
+
+def _to_ms(value) -> Optional[int]:
+    return None if value is None else int(pd.Timestamp(value).value // 1_000_000)
+
+
+def _from_ms(value) -> Optional[pd.Timestamp]:
+    return None if value is None else pd.Timestamp(int(value), unit='ms')
+
+
+def _load_state(row: PhaseState) -> PhaseStateMachine:
+    state = PhaseStateMachine(
+        thermophilic_start_time=_from_ms(row.thermophilic_start_ts),
+        thermophilic_end_time=_from_ms(row.thermophilic_end_ts),
+        first_time=_from_ms(row.first_ts),
+        last_time=_from_ms(row.last_ts),
+        latest_temp=np.nan if row.latest_temp is None else row.latest_temp) # type: ignore [reportArgumentType]
+    for name in _FLAGS:
+        setattr(state, name, bool(getattr(row, name)))
+    for name in _COUNTERS:
+        setattr(state, name, int(getattr(row, name)))
+    return state
+
+
+def _dump_state(pile_id: int, device_id: str, key: str, state: PhaseStateMachine) -> dict:
+    return {
+        "pile_id": pile_id,
+        "device_id": device_id,
+        "key": key,
+        "last_ts": _to_ms(state.last_time),
+        "first_ts": _to_ms(state.first_time),
+        "latest_temp": None if state.latest_temp is None or np.isnan(state.latest_temp) else float(state.latest_temp),
+        "current_phase": state.current_phase,
+        "thermophilic_start_ts": _to_ms(state.thermophilic_start_time),
+        "thermophilic_end_ts": _to_ms(state.thermophilic_end_time),
+        **{name: int(getattr(state, name)) for name in _FLAGS + _COUNTERS}
+    }
+
+
+def tail_start_ms(state: Optional[PhaseStateMachine]) -> Optional[int]:
+    """Oldest raw point the grid points after `state` depend on, None for a new series (its whole history)."""
+    if state is None or state.last_time is None:
+        return None
+    return preprocessing.bin_start(_to_ms(state.last_time) - preprocessing.context_ms()) # type: ignore [reportOperatorIssue]
+
+
+def advance(state: Optional[PhaseStateMachine], ts: np.ndarray,
+            values: np.ndarray) -> Tuple[Optional[PhaseStateMachine], List[Tuple[Any, str]], int]:
+    """
+    Advance `state` (None for a new series) over the complete grid points
+    after it of the raw points `ts`, `values`, which start at
+    `tail_start_ms(state)`. The bin of the newest point is not complete, it
+    may still get points. Returns the state, the phase changes and the
+    number of grid points processed.
+    """
+    if not len(ts):
+        return state, [], 0
+    temp_ma = preprocessing.temperature_ma(ts, values)
+    temp_ma = temp_ma[temp_ma.index < _from_ms(preprocessing.bin_start(int(ts[-1])))]
+    if state is not None:
+        temp_ma = temp_ma[temp_ma.index > state.last_time]
+    if temp_ma.empty:
+        return state, [], 0
+
+    if state is None:
+        state = PhaseStateMachine.from_series(temp_ma)
+        return state, list(state.phase_changes), len(temp_ma)
+    changes = []
+    for when, temp in zip(temp_ma.index, temp_ma.to_numpy()):
+        changes.extend(state.update(when, temp))
+    return state, changes, len(temp_ma)
+
+
+def advance_phase_state(pile_id: int, device_id: str, key: str) -> Tuple[Optional[PhaseStateMachine], List[Tuple[Any, str]]]:
+    """
+    Advance the stored phase state of a pile temperature series over the
+    grid points after the last processed one, and return it with the phase
+    changes they caused. Only the first run reads the whole history, later
+    ones the new points and the context their moving average and gap
+    filling need. Points arriving later than ones already processed are not
+    replayed.
+    """
+    with get_db() as db:
+        row = dao.get_phase_state(db, pile_id, device_id, key)
+        state = None if row is None else _load_state(row)
+        ts, values = dao.get_telemetry(db, pile_id, device_id, key, tail_start_ms(state))
+
+    state, changes, points = advance(state, ts, values)
+    if points:
+        with get_db() as db:
+            dao.save_phase_state(db, _dump_state(pile_id, device_id, key, state)) # type: ignore [reportArgumentType]
+        logging.debug(f"Pile {pile_id}: phase state advanced over {points} points")
+    return state, changes
@@ -1,9 +1,15 @@
+import bisect
 import datetime
 import logging
-from typing import Any, Dict, List
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
+from app.services.recommendation_rules import RuleSet, rule_sets
+
 
 def analyze_compost_status(
     temperature_history_df: pd.DataFrame,
@@ -11,9 +17,9 @@ def analyze_compost_status(
     start_date: datetime.datetime,              # Compost start date
     greens: int,                                # Total amount of greens added in the compost
     browns: int,                                # Total amount of browns added in the compost
-    forecast_temp: List[float],                # List of forecasted temperatures for the next day (24 hourly values)
-    forecast_humidity: List[float],           # List of forecasted humidity for the next day (24 hourly values)
-    forecast_precipitation: List[float]       # List of forecasted precipitation for the next day (optional)
+    forecast_temp: Sequence[float],            # Forecasted temperatures for the next day (24 hourly values)
+    forecast_humidity: Sequence[float],       # Forecasted humidity for the next day (24 hourly values)
+    rule_set: Optional[str] = None             # Recommendation rule set of the pile, see `recommendation_rules`
 ) -> Dict[str, Any]:
     """
     Analyzes compost status based on daily data, compost start date,
@@ -30,8 +36,9 @@ def analyze_compost_status(
     phase = infer_compost_phase_from_series(temperature_history_df["temp_ma"], compost_age_days)
 
     # Recommendations based on forecasted values for the next day
-    recommendation = generate_recommendations(avg_temp, avg_moisture, avg_ph)
-    weather_recommendation = generate_weather_recommendations(forecast_temp, forecast_precipitation, forecast_humidity)
+    rules = rule_sets.get(rule_set)
+    recommendation = generate_recommendations(avg_temp, avg_moisture, avg_ph, rules)
+    weather_recommendation = generate_weather_recommendations(forecast_temp, forecast_humidity, rules)
 
     # 7. Compile the results into a dictionary
     compost_status = {
@@ -122,80 +129,187 @@ def estimate_total_duration_static(greens_kg, browns_kg, compost_start_date, bas
     return days_elapsed, remaining_days
 
 # Phase Transistion Logic
-def detect_phases_transition(temp_df):
-    temp_series = temp_df['temp_ma']
-    thermophilic_started = False
-    thermophilic_start_time = None
-    thermophilic_end_time = None
-    thermophilic_days = 0
-    consecutive_above = 0
-    consecutive_below = 0
-
-    mesophilic_entered = False
-    thermophilic_entered = False
-    cooling_entered = False
-    maturation_entered = False
-
-    phase_changes = []
-
-    for ts, temp in temp_series.items():
-        if not mesophilic_entered and temp >= 20:
-            mesophilic_entered = True
-            phase_changes.append((ts, 'Mesophilic phase entered'))
-
-        if not thermophilic_started:
+@dataclass
+class PhaseStateMachine:
+    """
+    Phase transition detector that consumes moving-average temperatures one
+    point at a time, so it can follow a live stream as well as a full history.
+    """
+    thermophilic_started: bool = False
+    thermophilic_start_time: Optional[datetime.datetime] = None
+    thermophilic_end_time: Optional[datetime.datetime] = None
+    thermophilic_days: int = 0
+    consecutive_above: int = 0
+    consecutive_below: int = 0
+
+    mesophilic_entered: bool = False
+    thermophilic_entered: bool = False
+    cooling_entered: bool = False
+    maturation_entered: bool = False
+
+    first_time: Optional[datetime.datetime] = None
+    last_time: Optional[datetime.datetime] = None
+    latest_temp: Optional[float] = None
+    phase_changes: List[Tuple[Any, str]] = field(default_factory=list)
+
+    def update(self, ts, temp):
+        """Advance the state by one point. Returns the phase changes it caused."""
+        changes_before = len(self.phase_changes)
+        if self.first_time is None:
+            self.first_time = ts
+        self.last_time = ts
+        self.latest_temp = temp
+
+        if not self.mesophilic_entered and temp >= 20:
+            self.mesophilic_entered = True
+            self.phase_changes.append((ts, 'Mesophilic phase entered'))
+
+        if not self.thermophilic_started:
             if temp >= 40:
-                consecutive_above += 1
-                if consecutive_above >= 12:
-                    thermophilic_started = True
-                    thermophilic_start_time = ts
-                    thermophilic_entered = True
-                    phase_changes.append((ts, 'Thermophilic phase started'))
+                self.consecutive_above += 1
+                if self.consecutive_above >= 12:
+                    self.thermophilic_started = True
+                    self.thermophilic_start_time = ts
+                    self.thermophilic_entered = True
+                    self.phase_changes.append((ts, 'Thermophilic phase started'))
             else:
-                consecutive_above = 0
+                self.consecutive_above = 0
         else:
             if temp < 40:
-                consecutive_below += 1
-                if consecutive_below >= 1:
-                    thermophilic_end_time = ts
-                    duration = (thermophilic_end_time - thermophilic_start_time).days
-                    thermophilic_days += duration
-                    phase_changes.append((ts, f'Thermophilic phase ended after {duration} days'))
-                    thermophilic_started = False
-                    cooling_entered = True
+                self.consecutive_below += 1
+                if self.consecutive_below >= 1:
+                    self.thermophilic_end_time = ts
+                    duration = (self.thermophilic_end_time - self.thermophilic_start_time).days # type: ignore [reportOptionalOperand]
+                    self.thermophilic_days += duration
+                    self.phase_changes.append((ts, f'Thermophilic phase ended after {duration} days'))
+                    self.thermophilic_started = False
+                    self.cooling_entered = True
                 else:
-                    consecutive_below = 0
-
-        if cooling_entered and temp < 35:
-            maturation_entered = True
+                    self.consecutive_below = 0
+
+        if self.cooling_entered and temp < 35:
+            self.maturation_entered = True
+
+        return self.phase_changes[changes_before:]
+
+    @classmethod
+    def from_series(cls, temp_series: pd.Series) -> "PhaseStateMachine":
+        """
+        The state `update` reaches over the whole series, computed on arrays.
+
+        Threshold masks give the run lengths of points >= 40, and from them two
+        next-index arrays: the next point < 40, and the next point closing a run
+        of 12. Only the thermophilic episodes are then walked, not the points.
+        """
+        state = cls()
+        n = len(temp_series)
+        if not n:
+            return state
+        times = temp_series.index
+        temps = temp_series.to_numpy(dtype=np.float64)
+        state.first_time, state.last_time, state.latest_temp = times[0], times[-1], temp_series.iloc[-1]
+
+        # Comparisons with NaN are False, as in `update`
+        above = temps >= 40
+        below = temps < 40
+        idx = np.arange(n)
+
+        # Length of the run of points >= 40 ending at each point
+        run_start = np.maximum.accumulate(np.where(above, 0, idx + 1))
+        run_length = np.where(above, idx - run_start + 1, 0)
+
+        def next_index(mask):
+            # For every i, the first j >= i where mask is set, n if none
+            return np.minimum.accumulate(np.where(mask, idx, n)[::-1])[::-1]
+        next_below = np.append(next_index(below), n)
+        next_run12 = np.append(next_index(run_length == 12), n)
+
+        # The counter above 40 is not reset while the phase lasts, so right
+        # after an end a point >= 40 starts the phase again
+        starts, ends = [], []
+        counter, after_end = 0, None
+        start, restart = int(next_run12[0]), False
+        while start < n:
+            counter = counter + 1 if restart else 12
+            starts.append(start)
+            end = int(next_below[start + 1])
+            if end >= n:
+                break
+            ends.append(end)
+            after_end = end + 1
+            restart = bool(after_end < n and above[after_end])
+            start = after_end if restart else int(next_run12[after_end])
+
+        state.thermophilic_started = len(starts) > len(ends)
+        state.thermophilic_entered = bool(starts)
+        state.cooling_entered = bool(ends)
+        state.consecutive_below = len(ends)
+        # A counter not reset by any point after the last end stays stale
+        if state.thermophilic_started or after_end == n:
+            state.consecutive_above = counter
+        else:
+            state.consecutive_above = int(run_length[-1])
+        if ends:
+            state.maturation_entered = bool((temps[ends[0]:] < 35).any())
+
+        durations = (times[ends] - times[starts[:len(ends)]]).days.tolist() if ends else []
+        state.thermophilic_days = sum(durations)
+
+        # Starts and ends alternate, and mesophilic comes first among changes at the same point
+        events = []
+        for k, i in enumerate(starts):
+            events.append((i, 'Thermophilic phase started'))
+            if k < len(ends):
+                events.append((ends[k], f'Thermophilic phase ended after {durations[k]} days'))
+        mesophilic = np.flatnonzero(temps >= 20)
+        if len(mesophilic):
+            state.mesophilic_entered = True
+            first = int(mesophilic[0])
+            events.insert(bisect.bisect_left([i for i, _ in events], first), (first, 'Mesophilic phase entered'))
+        event_times = times[[i for i, _ in events]].tolist() if events else []
+        state.phase_changes = [(t, label) for t, (_, label) in zip(event_times, events)]
+        if starts:
+            state.thermophilic_start_time = times[starts[-1]]
+        if ends:
+            state.thermophilic_end_time = times[ends[-1]]
+        return state
+
+    @property
+    def current_phase(self) -> str:
+        current_phase = "Unknown"
+        latest_temp = self.latest_temp
+
+        if latest_temp < 20: # type: ignore [reportOptionalOperand]
+            current_phase = 'Maturation'
+        elif latest_temp < 40: # type: ignore [reportOptionalOperand]
+            if self.thermophilic_entered:
+                current_phase = 'Cooling'
+            else:
+                current_phase = 'Mesophilic'
+        else:
+            current_phase = 'Thermophilic'
+        return current_phase
 
-    current_phase = "Unknown"
-    latest_temp = temp_series.iloc[-1]
+    @property
+    def anomaly(self) -> Optional[str]:
+        anomaly = None
+        if not self.thermophilic_entered:
+            anomaly = 'no_thermophilic'
+        elif self.thermophilic_days < 3:
+            anomaly = 'short_thermophilic'
+        elif self.mesophilic_entered and self.thermophilic_start_time:
+            mesophilic_days = (self.thermophilic_start_time - self.first_time).days # type: ignore [reportOperatorIssue]
 
-    if latest_temp < 20:
-        current_phase = 'Maturation'
-    elif latest_temp < 40:
-        if thermophilic_entered:
-            current_phase = 'Cooling'
-        else:
-            current_phase = 'Mesophilic'
-    else:
-        current_phase = 'Thermophilic'
+            if mesophilic_days > 5:
+                anomaly = 'delayed_warmup'
+        return anomaly
 
-    # Anomaly detection
-    anomaly = None
-    total_days = (temp_series.index[-1] - temp_series.index[0]).days
-    if not thermophilic_entered:
-        anomaly = 'no_thermophilic'
-    elif thermophilic_days < 3:
-        anomaly = 'short_thermophilic'
-    elif mesophilic_entered and thermophilic_start_time:
-        mesophilic_days = (thermophilic_start_time - temp_series.index[0]).days
 
-        if mesophilic_days > 5:
-            anomaly = 'delayed_warmup'
+def detect_phases_transition(temp_df):
+    state = PhaseStateMachine.from_series(temp_df['temp_ma'])
 
-    return phase_changes, current_phase, mesophilic_entered, thermophilic_entered, cooling_entered, maturation_entered, anomaly
+    return (state.phase_changes, state.current_phase, state.mesophilic_entered, state.thermophilic_entered,
+            state.cooling_entered, state.maturation_entered, state.anomaly)
 
 
 # Compost Phase Detection
@@ -233,95 +347,50 @@ def infer_compost_phase_from_series(temp_df, days_since_start) -> str:
 
 
 # Generate compose recommendation based on  Temp, PH, Moisture
-def generate_recommendations(temp, moisture, ph):
-    rec = []
-    if temp < 20:
-        rec.append("Temperature too low → Add greens, turn pile, insulate pile.")
-    elif temp < 40:
-        rec.append("Mesophilic phase → Add greens and increase pile size if slow.")
-    elif temp > 70:
-        rec.append("Temperature too high → Turn pile, add browns, moisten pile.")
-
-    if moisture < 30:
-        rec.append("Moisture too low → Add water and turn pile.")
-    elif moisture > 65:
-        rec.append("Moisture too high → Add dry browns and turn pile.")
+def generate_recommendations(temp, moisture, ph, rules: Optional[RuleSet] = None):
+    rules = rules or rule_sets.get()
+    return rules["recommendation"].recommend({"temperature": temp, "moisture": moisture, "ph": ph})[0]
 
-    if ph < 5.5:
-        rec.append("pH too low → Add lime or wood ash.")
-    elif ph > 8.5:
-        rec.append("pH too high → Add acidic greens and water.")
 
-    return rec
+def _forecast_values(values) -> np.ndarray:
+    values = np.asarray(values if values is not None else [], dtype=float)
+    return values[~np.isnan(values)]
 
 
 # Weather recommendations based on 3-hour weather forecast for the next day
 def generate_weather_recommendations(
-        ambient_temp_forecast: List[float],
-        precipitation_forecast: List[float],
-        humidity_forecast: List[float]) -> List[str]:
-    
-    rec = []
+        ambient_temp_forecast: Union[Mapping[str, Sequence[float]], pd.DataFrame, Sequence[float]],
+        humidity_forecast: Optional[Sequence[float]] = None,
+        rules: Optional[RuleSet] = None) -> List[str]:
+    """
+    Takes either the temperature and humidity series, or the whole forecast with one
+    column per property, as returned by `weather_service.get_24h_forecast`.
+    Missing (NaN) values are ignored, and so are the temperature and humidity
+    rules when a series has no values.
+    """
+    if isinstance(ambient_temp_forecast, (Mapping, pd.DataFrame)):
+        forecast = ambient_temp_forecast
+        ambient_temp_forecast = forecast.get("temperature")
+        humidity_forecast = forecast.get("humidity")
+    rules = rules or rule_sets.get()
 
     # --- Temperature Analysis ---
-    avg_temp = sum(ambient_temp_forecast) / len(ambient_temp_forecast)
-    min_temp = min(ambient_temp_forecast)
-    max_temp = max(ambient_temp_forecast)
-
-    if max_temp < 10:
-        rec.append("Consistently cold day → Insulate or enlarge pile.")
-    elif min_temp > 30:
-        rec.append("Very warm day → Monitor for overheating and drying.")
-    elif avg_temp < 10:
-        rec.append("Average temp low → May slow decomposition, consider insulation.")
-    elif avg_temp > 30:
-        rec.append("Average temp high → Monitor for overheating.")
-    else:
-        rec.append("Temperature in optimal values for next day")
-
-    # --- Precipitation Analysis ---
-    # total_precip = sum(precipitation_forecast)
-    # high_precip_intervals = [p for p in precipitation_forecast if p > 5]
-
-    # if total_precip > 10:
-    #     rec.append("Heavy rain expected → Cover pile or add extra dry browns.")
-    # elif total_precip == 0:
-    #     rec.append("No rain forecast → Monitor moisture and consider watering.")
-    # elif len(high_precip_intervals) >= 2:
-    #     rec.append("Several heavy showers → Check drainage and cover pile.")
-
-    # --- Humidity Analysis ---
-    avg_humidity = sum(humidity_forecast) / len(humidity_forecast)
-
-    if avg_humidity < 40:
-        rec.append("Low humidity forecast → Moisten pile and reduce turning.")
-    elif avg_humidity > 80:
-        rec.append("High humidity forecast → Risk of anaerobic conditions, turn pile.")
-    else:
-        rec.append("Humidity in optimal conditions")
+    # NaN when the forecast has no values, which matches no rule
+    min_temp, max_temp, avg_temp, avg_humidity = forecast_aggregates(
+        {"temperature": ambient_temp_forecast, "humidity": humidity_forecast})
 
-    return rec
+    return rules["weather_recommendation"].recommend({
+        "forecast_temp_min": min_temp,
+        "forecast_temp_max": max_temp,
+        "forecast_temp_avg": avg_temp,
+        "forecast_humidity_avg": avg_humidity
+    })[0]
 
 
 # Recommendations for NPK measures
-def generate_npk_recommendations(n, p, k):
-    rec = []
-    if n < 300:
-        rec.append("Nitrogen is low → Add greens like vegetable scraps or manure.")
-    elif n > 1000:
-        rec.append("Nitrogen is very high → Add browns and turn pile to avoid odor and nitrogen loss.")
-
-    if p < 100:
-        rec.append("Phosphorus is low → Compost is still immature or poor material mix.")
-    elif p > 500:
-        rec.append("Phosphorus stabilized → Compost likely mature.")
-
-    if k < 200:
-        rec.append("Potassium low → Continue curing.")
-    elif k > 800:
-        rec.append("Potassium high → Compost is nutrient rich and mature.")
-
-    return rec
+def generate_npk_recommendations(n, p, k, rules: Optional[RuleSet] = None):
+    rules = rules or rule_sets.get()
+    return rules["npk_recommendation"].recommend({"n": n, "p": p, "k": k})[0]
 
 
 # Estimate speed factor
@@ -359,4 +428,180 @@ def classify_materials(material_list):
         speed_factor = 1.0
 
     # Return the calculated speed factor
-    return speed_factor
\ No newline at end of file
+    return speed_factor
+
+# Batch analysis of many piles at once, one array row per pile
+PHASES = (
+    "Insufficient data",
+    "Maturation Phase",
+    "Inactive",
+    "Mesophilic Phase (heating up)",
+    "Cooling Phase (declining)",
+    "Stable Mesophilic",
+    "Late Cooling",
+    "Phase is unstable! Please check the compost",
+    "Thermophilic Phase (active)",
+    "Thermophilic Cooling Phase (declining)",
+    "Stable Thermophilic Phase",
+    "Possible sensor error or overheating",
+)
+def calculate_cn_ratios(greens_kg, browns_kg, cn_greens=15, cn_browns=60) -> np.ndarray:
+    greens_kg = np.asarray(greens_kg, dtype=float)
+    browns_kg = np.asarray(browns_kg, dtype=float)
+    total_carbon = greens_kg * cn_greens + browns_kg * cn_browns
+    total_nitrogen = greens_kg + browns_kg
+    return np.divide(total_carbon, total_nitrogen, out=np.zeros_like(total_carbon), where=total_nitrogen != 0)
+
+
+def base_speed_factors(cn_ratio) -> np.ndarray:
+    cn = np.asarray(cn_ratio, dtype=float)
+    return np.select([
+        (25 <= cn) & (cn <= 30),
+        ((20 <= cn) & (cn < 25)) | ((30 < cn) & (cn <= 35)),
+        ((15 <= cn) & (cn < 20)) | ((35 < cn) & (cn <= 40)),
+    ], [1.0, 0.8, 0.6], 0.4)
+
+
+def _band_factors(values, lower_edges, upper_edges, factors) -> np.ndarray:
+    """
+    Factor of the band of each value, bands closed on their `lower_edges`
+    side below the optimum and on their `upper_edges` side above it. NaN falls
+    in the last band.
+    """
+    values = np.asarray(values, dtype=float)
+    band = np.searchsorted(lower_edges, values, side='right') + np.searchsorted(upper_edges, values, side='left')
+    return np.asarray(factors)[band]
+
+
+def temp_factors(temp_c) -> np.ndarray:
+    """`temp_factor` over arrays."""
+    return _band_factors(temp_c, [40, 50, 55], [65, 70], [0.4, 0.6, 0.85, 1.0, 0.85, 0.4])
+
+
+def humidity_factors(humidity_percent) -> np.ndarray:
+    """`humidity_factor` over arrays."""
+    return _band_factors(humidity_percent, [40, 45, 50], [60, 65, 70], [0.4, 0.6, 0.85, 1.0, 0.85, 0.6, 0.4])
+
+
+def estimate_total_durations_static(greens_kg, browns_kg, compost_start_dates, base_days=90,
+                                    today: Optional[datetime.date] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """`estimate_total_duration_static` over arrays: (days elapsed, remaining days)."""
+    speed_factor = base_speed_factors(calculate_cn_ratios(greens_kg, browns_kg))
+    # np.rint rounds half to even, as `round` does
+    total_estimated_days = np.rint(base_days / speed_factor).astype(np.int64)
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    days_elapsed = (today - np.asarray(compost_start_dates, dtype='datetime64[D]')).astype(np.int64)
+    remaining_days = np.maximum(total_estimated_days - days_elapsed, 0)
+    return days_elapsed, remaining_days
+
+
+def temperature_trend(temp_series: pd.Series) -> Tuple[int, float, float]:
+    """(points, latest value, 1-day trend) of a moving average series, as `infer_compost_phase_from_series` reads it."""
+    values = np.asarray(temp_series, dtype=float)
+    if len(values) < 2:
+        return len(values), np.nan, np.nan
+    trend = np.diff(values)
+    trend = trend[~np.isnan(trend)][-70:]
+    return len(values), float(values[-1]), float(trend.mean()) if len(trend) else np.nan
+
+
+def infer_compost_phases(points, latest_temp, avg_trend, days_since_start) -> np.ndarray:
+    """Codes into PHASES, the batch version of `infer_compost_phase_from_series`."""
+    points = np.asarray(points)
+    t = np.asarray(latest_temp, dtype=float)
+    trend = np.asarray(avg_trend, dtype=float)
+    age = np.asarray(days_since_start)
+    mesophilic = (20 <= t) & (t <= 40)
+    thermophilic = (40 < t) & (t <= 70)
+    return np.select([
+        points < 2,
+        (t < 20) & (age > 30),
+        t < 20,
+        mesophilic & (trend > 2),
+        mesophilic & (trend < -2),
+        mesophilic & (age < 8),
+        mesophilic & (age > 30),
+        mesophilic,
+        thermophilic & (trend > 0),
+        thermophilic & (trend < -1),
+        thermophilic,
+    ], np.arange(11), 11).astype(np.int8)
+
+
+def forecast_aggregates(forecast) -> Tuple[float, float, float, float]:
+    """(min, max, average temperature, average humidity) of a forecast, NaN ignored."""
+    temps = _forecast_values(forecast.get("temperature"))
+    humidity = _forecast_values(forecast.get("humidity"))
+
+    def mean(values):
+        return float(values.sum()) / len(values) if len(values) else np.nan
+    if not len(temps):
+        return np.nan, np.nan, np.nan, mean(humidity)
+    return float(temps.min()), float(temps.max()), mean(temps), mean(humidity)
+
+
+@dataclass
+class CompostStatusBatch:
+    """
+    Columnar result of `analyze_compost_status_batch`. Phases are codes into
+    PHASES, recommendations the rule codes of `RuleTable.evaluate`.
+    """
+    rules: RuleSet
+    compost_age_days: np.ndarray
+    estimated_duration: np.ndarray
+    estimated_days_remaining: np.ndarray
+    phase: np.ndarray
+    recommendation: np.ndarray
+    weather_recommendation: np.ndarray
+
+    def __len__(self):
+        return len(self.phase)
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """Row `i` in the form `analyze_compost_status` returns."""
+        return {
+            "compost_age_days": int(self.compost_age_days[i]),
+            "phase": PHASES[self.phase[i]],
+            "estimated_duration": int(self.estimated_duration[i]),
+            "estimated_days_remaining": int(self.estimated_days_remaining[i]),
+            "recommendation": self.rules["recommendation"].messages_of(self.recommendation, i),
+            "weather_recommendation": self.rules["weather_recommendation"].messages_of(self.weather_recommendation, i),
+        }
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [self.record(i) for i in range(len(self))]
+
+
+def analyze_compost_status_batch(
+    avg_temp, avg_moisture, avg_ph,                 # Daily averages per pile
+    start_dates,                                    # Compost start dates
+    greens, browns,                                 # Amounts of greens and browns added
+    temp_points, latest_temp, temp_trend,           # Moving average temperature, see `temperature_trend`
+    forecast_temp_min, forecast_temp_max, forecast_temp_avg, forecast_humidity_avg,  # See `forecast_aggregates`
+    today: Optional[datetime.date] = None,
+    rule_set: Optional[str] = None                  # Recommendation rule set shared by the piles
+) -> CompostStatusBatch:
+    """
+    `analyze_compost_status` for many piles at once, every argument an array
+    with one row per pile. The phase ladder becomes np.select over whole
+    columns and the recommendation rules are evaluated in one pass. A NaN
+    input yields no recommendation for its variable, and a pile without
+    forecast gets no weather recommendation.
+    """
+    compost_age_days, remaining_days = estimate_total_durations_static(greens, browns, start_dates, today=today)
+    rules = rule_sets.get(rule_set)
+
+    return CompostStatusBatch(
+        rules=rules,
+        compost_age_days=compost_age_days,
+        estimated_duration=compost_age_days + remaining_days,
+        estimated_days_remaining=remaining_days,
+        phase=infer_compost_phases(temp_points, latest_temp, temp_trend, compost_age_days),
+        recommendation=rules["recommendation"].evaluate({
+            "temperature": avg_temp, "moisture": avg_moisture, "ph": avg_ph}),
+        weather_recommendation=rules["weather_recommendation"].evaluate({
+            "forecast_temp_min": forecast_temp_min,
+            "forecast_temp_max": forecast_temp_max,
+            "forecast_temp_avg": forecast_temp_avg,
+            "forecast_humidity_avg": forecast_humidity_avg}),
+    )
@@ -0,0 +1,73 @@
+# Preprocessing of telemetry before analysis: a regular time grid and time-based windows
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+
+
+def period_ms(period) -> int:
+    return int(pd.Timedelta(period).value // 1_000_000)
+
+
+def grid_ms(freq: Optional[str] = None) -> int:
+    return period_ms(freq or settings.TEMPERATURE_GRID)
+
+
+def bin_start(ts_ms: int, freq: Optional[str] = None) -> int:
+    """Start of the grid bin of an epoch ms timestamp. Bins are aligned on the epoch."""
+    step = grid_ms(freq)
+    return int(ts_ms) - int(ts_ms) % step
+
+
+def context_ms(freq: Optional[str] = None) -> int:
+    """How far before a grid point the raw points it depends on can be."""
+    return period_ms(settings.TEMPERATURE_MA_WINDOW) + period_ms(settings.TEMPERATURE_MAX_GAP) + grid_ms(freq)
+
+
+def regularize(ts: np.ndarray, values: np.ndarray, freq: Optional[str] = None,
+               max_gap: Optional[str] = None) -> pd.Series:
+    """
+    Resample the epoch ms `ts` and `values` of a series onto a regular grid
+    of `freq` bins, each the mean of its points and labelled by its start.
+    Empty bins are interpolated in time when the bins with points around them
+    are at most `max_gap` apart, and stay NaN across longer gaps. Dense
+    sensors are averaged down and sparse ones filled in, so a day always has
+    the same number of points.
+    """
+    step = grid_ms(freq)
+    max_gap_ms = period_ms(max_gap or settings.TEMPERATURE_MAX_GAP)
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    ts, values = ts[known], values[known]
+    if not len(ts):
+        return pd.Series(dtype=np.float64, index=pd.DatetimeIndex([], name="datetime"))
+
+    bins = ts // step
+    first = int(bins.min())
+    offsets = bins - first
+    n = int(offsets.max()) + 1
+    counts = np.bincount(offsets, minlength=n)
+    sums = np.bincount(offsets, weights=values, minlength=n)
+    grid = (first + np.arange(n, dtype=np.int64)) * step
+
+    full = np.flatnonzero(counts)
+    means = sums[full] / counts[full]
+    filled = np.interp(grid, grid[full], means)
+    # The first and last bins have points, so every bin has both neighbours
+    before = grid[full][np.searchsorted(full, np.arange(n), side='right') - 1]
+    after = grid[full][np.searchsorted(full, np.arange(n), side='left')]
+    filled[after - before > max_gap_ms] = np.nan
+    return pd.Series(filled, index=pd.DatetimeIndex(pd.to_datetime(grid, unit='ms'), name="datetime"))
+
+
+def moving_average(series: pd.Series, window: Optional[str] = None) -> pd.Series:
+    """Time-based moving average, NaN ignored, over `window` up to each point."""
+    return series.rolling(window or settings.TEMPERATURE_MA_WINDOW, min_periods=1).mean()
+
+
+def temperature_ma(ts: np.ndarray, values: np.ndarray) -> pd.Series:
+    """Moving average temperature on the regular grid, as the phase analysis reads it."""
+    return moving_average(regularize(ts, values))
@@ -0,0 +1,150 @@
+# Recommendation rules, declared as JSON tables and compiled for numpy evaluation
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+BUNDLED_RULES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules")
+DEFAULT_RULE_SET = "default"
+NO_MATCH = -1
+
+_BOUNDS = {"gt": -np.inf, "ge": -np.inf, "lt": np.inf, "le": np.inf}
+_RULE_KEYS = {"variable", "message", *_BOUNDS}
+_NAME = re.compile(r"^[\w-]+$")
+
+
+class RuleTable:
+    """
+    The rules of one output (e.g. "recommendation"), compiled to arrays.
+
+    Rules come in ordered groups, and within a group the first matching rule
+    wins, as in an if/elif ladder. A rule reads one `variable` and matches
+    when it is within all its optional bounds `gt`, `ge`, `lt` and `le`. A
+    rule without bounds matches any value, and a missing (NaN) value matches
+    no rule.
+    """
+
+    def __init__(self, groups: Mapping[str, List[Mapping]]):
+        self.groups: Tuple[str, ...] = tuple(name for name, rules in groups.items() if rules)
+        rules = [rule for name in self.groups for rule in groups[name]]
+        for rule in rules:
+            unknown = set(rule) - _RULE_KEYS
+            if unknown or not isinstance(rule.get("variable"), str) or not isinstance(rule.get("message"), str):
+                raise ValueError(f"Invalid rule {rule}")
+        self.variables: Tuple[str, ...] = tuple(dict.fromkeys(rule["variable"] for rule in rules))
+        self.messages: Tuple[str, ...] = tuple(rule["message"] for rule in rules)
+        self._rule_variable = np.array([self.variables.index(rule["variable"]) for rule in rules], dtype=np.intp)
+        self._bounds = {
+            bound: np.array([float(rule.get(bound, default)) for rule in rules])[:, None]
+            for bound, default in _BOUNDS.items()}
+        self._group_starts = np.cumsum([0] + [len(groups[name]) for name in self.groups[:-1]])
+
+    def evaluate(self, columns: Mapping) -> np.ndarray:
+        """
+        Apply all rules to a column of values per variable, one row per pile
+        (scalars for a single pile). Returns the index of the matching rule of
+        every group, shaped (groups, piles), NO_MATCH where none matched.
+        """
+        missing = [v for v in self.variables if v not in columns]
+        if missing:
+            raise ValueError(f"No values for rule variables {missing}")
+        values = np.vstack(np.broadcast_arrays(*(np.atleast_1d(np.asarray(columns[v], dtype=float))
+                                                 for v in self.variables)))
+        if not len(self.groups):
+            return np.empty((0, values.shape[1]), dtype=np.int16)
+
+        rule_values = values[self._rule_variable]  # (rules, piles)
+        matches = ((rule_values > self._bounds["gt"]) & (rule_values >= self._bounds["ge"])
+                   & (rule_values < self._bounds["lt"]) & (rule_values <= self._bounds["le"]))
+        # First match per group: the lowest rule index among the matching ones
+        candidates = np.where(matches, np.arange(len(self.messages))[:, None], len(self.messages))
+        codes = np.minimum.reduceat(candidates, self._group_starts, axis=0)
+        return np.where(codes == len(self.messages), NO_MATCH, codes).astype(np.int16)
+
+    def messages_of(self, codes: np.ndarray, i: int = 0) -> List[str]:
+        """Messages of pile `i` from the codes `evaluate` returned."""
+        return [self.messages[c] for c in codes[:, i] if c != NO_MATCH]
+
+    def recommend(self, columns: Mapping) -> List[List[str]]:
+        codes = self.evaluate(columns)
+        return [self.messages_of(codes, i) for i in range(codes.shape[1])]
+
+
+class RuleSet:
+    """A named rule set: one RuleTable per output."""
+
+    def __init__(self, table: Mapping[str, Mapping[str, List[Mapping]]], name: str = DEFAULT_RULE_SET):
+        self.name = name
+        self.tables: Dict[str, RuleTable] = {output: RuleTable(groups) for output, groups in table.items()}
+
+    def __getitem__(self, output: str) -> RuleTable:
+        return self.tables[output]
+
+    @classmethod
+    def from_file(cls, path: str, name: str = DEFAULT_RULE_SET) -> "RuleSet":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), name)
+
+
+class RuleSetRegistry:
+    """
+    Compiled rule sets by tenant. The rule set `name` is read from
+    `<RULES_DIR>/<name>.json`, else from the bundled rules, and a tenant
+    without its own file gets the default rule set. A file is compiled once
+    and compiled again only after it changed on disk, so rule sets can be
+    edited without restarting the scheduler. An invalid edit is logged and
+    the previous version kept.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[str, int, RuleSet]] = {}
+
+    def _path(self, name: str) -> Optional[str]:
+        for directory in (self._directory or settings.RULES_DIR, BUNDLED_RULES_DIR):
+            path = os.path.join(directory, f"{name}.json") if directory else None
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    def get(self, name: Optional[str] = None) -> RuleSet:
+        name = name or settings.RULE_SET
+        if not isinstance(name, str):
+            logging.warning(f"Rule set name {name!r} is not a string, using '{DEFAULT_RULE_SET}'")
+            return self.get(DEFAULT_RULE_SET)
+        path = self._path(name) if _NAME.match(name) else None
+        if path is None:
+            if name == DEFAULT_RULE_SET:
+                raise FileNotFoundError(f"No '{DEFAULT_RULE_SET}' rule set found")
+            logging.debug(f"No rule set '{name}', using '{DEFAULT_RULE_SET}'")
+            return self.get(DEFAULT_RULE_SET)
+
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached and cached[:2] == (path, mtime):
+                return cached[2]
+            try:
+                rule_set = RuleSet.from_file(path, name)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                if not cached:
+                    raise
+                logging.error(f"Rule set '{name}' not reloaded from {path}: {e}")
+                # Not retried until the file changes again
+                self._cache[name] = (path, mtime, cached[2])
+                return cached[2]
+            self._cache[name] = (path, mtime, rule_set)
+            if cached:
+                logging.info(f"Reloaded rule set '{name}' from {path}")
+            return rule_set
+
+
+# Process-wide rule sets
+rule_sets = RuleSetRegistry()
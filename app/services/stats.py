@@ -0,0 +1,124 @@
+# Mergeable summary statistics of telemetry values
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+DAY_MS = 86_400_000
+
+
+def day_start_ms(ts_ms: int) -> int:
+    """Start of the UTC day of an epoch ms timestamp."""
+    return int(ts_ms) - int(ts_ms) % DAY_MS
+
+
+def bucket_stats(ts: np.ndarray, values: np.ndarray, period_ms: int) -> Tuple[np.ndarray, ...]:
+    """
+    StatsAccumulator columns of the points in every epoch aligned bucket of
+    `period_ms`, NaN ignored: (starts, count, mean, m2, min, max), one entry
+    per bucket with points. `ts` must be ascending.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    ts, values = ts[known], values[known]
+    if not len(ts):
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), empty, empty, empty, empty
+    starts, first, counts = np.unique(ts - ts % period_ms, return_index=True, return_counts=True)
+    means = np.add.reduceat(values, first) / counts
+    deviations = values - np.repeat(means, counts)
+    return (starts, counts, means, np.add.reduceat(deviations * deviations, first),
+            np.minimum.reduceat(values, first), np.maximum.reduceat(values, first))
+
+
+@dataclass
+class StatsAccumulator:
+    """
+    Count, mean, M2 (sum of squared deviations from the mean), min and max of
+    a set of values. It is updated one value at a time (Welford) or from
+    whole arrays, and merged with the accumulator of another set (Chan et
+    al.), so stats of devices, windows or days combine without their raw
+    values. M2 is NaN when unknown, as for stats reduced by ThingsBoard, and
+    so is the standard deviation then.
+    """
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+
+    def update(self, value: float) -> "StatsAccumulator":
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        return self
+
+    def update_array(self, values) -> "StatsAccumulator":
+        """Fold in a chunk of values, NaN ignored."""
+        return self.merge(StatsAccumulator.from_array(values))
+
+    def merge(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        """Fold in the stats of another set of values, in place."""
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def __add__(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        return StatsAccumulator(self.count, self.mean, self.m2, self.min, self.max).merge(other)
+
+    @classmethod
+    def from_array(cls, values) -> "StatsAccumulator":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return cls()
+        mean = float(values.mean())
+        deviations = values - mean
+        return cls(int(values.size), mean, float(np.dot(deviations, deviations)), float(values.min()), float(values.max()))
+
+    @classmethod
+    def merged(cls, accumulators: Iterable["StatsAccumulator"]) -> "StatsAccumulator":
+        total = cls()
+        for accumulator in accumulators:
+            total.merge(accumulator)
+        return total
+
+    @classmethod
+    def from_dict(cls, stats: Dict) -> "StatsAccumulator":
+        """From a daily stats dict (min, max, avg, count and std, which may be None)."""
+        count = int(stats.get('count') or 0)
+        std = stats.get('std')
+        m2 = math.nan if std is None else float(std) ** 2 * count
+        return cls(count, float(stats['avg']), m2, float(stats['min']), float(stats['max']))
+
+    @property
+    def std(self) -> Optional[float]:
+        """Population standard deviation, as np.std."""
+        if not self.count or math.isnan(self.m2):
+            return None
+        return math.sqrt(self.m2 / self.count)
+
+    def as_dict(self) -> Dict[str, float]:
+        """The daily stats dict the analysis reads."""
+        return {
+            'min': self.min,
+            'max': self.max,
+            'avg': self.mean,
+            'count': self.count,
+            'std': self.std # type: ignore [reportReturnType]
+        }
@@ -0,0 +1,137 @@
+import datetime
+import itertools
+import logging
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.db.database import get_db
+import app.db.crud as dao
+import app.services.thingsboard as tb
+import app.services.datacake_client as dk
+from app.services import preprocessing
+from app.services.stats import DAY_MS, StatsAccumulator, day_start_ms
+
+HOURLY_MAX_SPAN_MS = 7 * DAY_MS  # Longest range served hourly when no resolution is asked
+# Variables the analysis reads, by the fragments of the device keys holding them, later ones first
+VARIABLE_KEYS = {"ph": ("ph",), "moisture": ("water", "moisture"), "temperature": ("temp",)}
+
+
+def variable_name(key: str) -> Optional[str]:
+    """Analysis variable of a ThingsBoard key or Datacake field, e.g. SOIL_TEMPERATURE -> temperature."""
+    return next((variable for variable, fragments in VARIABLE_KEYS.items()
+                 if any(f in key.lower() for f in fragments)), None)
+
+
+def _now_ms() -> int:
+    return int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+
+
+def _date_to_ms(value) -> int:
+    return int(pd.to_datetime(value).timestamp() * 1000)
+
+
+def sync_thingsboard_series(pile_id: int, device_id: str, key: str, start_date) -> int:
+    """
+    Fetch the points of one ThingsBoard series newer than its watermark
+    (or since the pile start date on the first run) into the local store.
+    Returns the number of new points.
+    """
+    with get_db() as db:
+        watermark = dao.get_telemetry_watermark(db, pile_id, device_id, key)
+
+    start_ts = watermark + 1 if watermark is not None else _date_to_ms(start_date)
+    ts, values = tb.get_telemetry_arrays(device_id, key, start_ts, _now_ms())
+
+    with get_db() as db:
+        inserted = dao.insert_telemetry(db, pile_id, device_id, key, ts, values)
+    logging.info(f"Stored {inserted} new '{key}' points for device {device_id}")
+    return inserted
+
+
+def datacake_history_start(workspace_id: str, start_date) -> datetime.datetime:
+    """
+    Start of the temperature history a Datacake pile run still needs: the
+    oldest watermark of its temperature fields, or the pile start date on the
+    first run. The bucket at the watermark is fetched again, since Datacake may
+    have aggregated it before it was over.
+    """
+    with get_db() as db:
+        pile = dao.get_pile_by_ext_id(db, workspace_id)
+        watermark = dao.get_oldest_telemetry_watermark(db, pile.id, dk.temperature_fields()) if pile else None # type: ignore [reportArgumentType]
+    start_ts = _date_to_ms(start_date) if watermark is None else watermark
+    return datetime.datetime.fromtimestamp(start_ts / 1000, datetime.timezone.utc)
+
+
+def store_datacake_history(pile_id: int, device_id: str, fields: List[str], history) -> int:
+    """
+    Store the given fields of a Datacake `history` (the JSON string of the API
+    or its decoded list). Returns the number of stored points.
+    """
+    columns = dk.decode_history(history, fields)
+    if not len(columns):
+        return 0
+
+    stored = 0
+    with get_db() as db:
+        for field, values in columns.values.items():
+            mask = ~np.isnan(values)
+            if mask.any():
+                stored += dao.insert_telemetry(db, pile_id, device_id, field, columns.ts[mask], values[mask])
+    logging.info(f"Stored {stored} Datacake points of {fields} for device {device_id}")
+    return stored
+
+
+def load_temperature_ma(pile_id: int, device_id: str, key: str, points: int) -> pd.Series:
+    """
+    The last `points` grid points of the moving average temperature of one
+    stored series, reading only the raw points they depend on.
+    """
+    with get_db() as db:
+        watermark = dao.get_telemetry_watermark(db, pile_id, device_id, key)
+        if watermark is None:
+            return preprocessing.temperature_ma(np.empty(0, dtype=np.int64), np.empty(0))
+        start_ts = preprocessing.bin_start(watermark) - points * preprocessing.grid_ms() - preprocessing.context_ms()
+        ts, values = dao.get_telemetry(db, pile_id, device_id, key, start_ts)
+    return preprocessing.temperature_ma(ts, values).iloc[-points:]
+
+
+def save_daily_stats(pile_id: int, device_id: str, key: str, stats: StatsAccumulator, day: Optional[int] = None):
+    """Store the accumulator of one day (today by default) of a series. Empty ones are skipped."""
+    if not stats.count:
+        return
+    day = day_start_ms(_now_ms() if day is None else day)
+    with get_db() as db:
+        dao.save_daily_stats(db, pile_id, device_id, key, day, stats.count, stats.mean,
+                             None if math.isnan(stats.m2) else stats.m2, stats.min, stats.max)
+
+
+def rollup_resolution(start_ts: Optional[int], end_ts: Optional[int]) -> str:
+    """Hourly rollups for ranges up to HOURLY_MAX_SPAN_MS, daily ones beyond or for open ranges."""
+    if start_ts is None:
+        return "day"
+    return "hour" if (_now_ms() if end_ts is None else end_ts) - start_ts <= HOURLY_MAX_SPAN_MS else "day"
+
+
+def rollup_series(pile_id: int, variable: str, resolution: Optional[str] = None,
+                  start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[Dict]:
+    """
+    Hourly or daily stats of a variable of a pile over the buckets starting
+    in [start_ts, end_ts), read from the rollups kept up to date on
+    ingestion. The variable is a name of VARIABLE_KEYS, read from every key
+    of the pile that `variable_name` maps to it whatever the platform of its
+    device, or else a raw telemetry key. The series are merged per bucket.
+    """
+    resolution = resolution or rollup_resolution(start_ts, end_ts)
+    if resolution not in dao.ROLLUP_PERIODS:
+        raise ValueError(f"Unknown resolution '{resolution}', expected one of {list(dao.ROLLUP_PERIODS)}")
+    with get_db() as db:
+        keys = [k for k in dao.get_telemetry_keys(db, pile_id) if variable_name(k) == variable or k == variable]
+        rows = dao.get_telemetry_rollups(db, pile_id, keys, resolution, start_ts, end_ts) if keys else []
+    return [
+        {"ts": start, **StatsAccumulator.merged(
+            StatsAccumulator(r.count, r.mean, r.m2, r.min, r.max) for r in bucket).as_dict()} # type: ignore [reportArgumentType]
+        for start, bucket in itertools.groupby(rows, key=lambda r: r.start)
+    ]
@@ -1,35 +1,122 @@
 import os
-from typing import Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
 import logging
 
 from app.config import settings
+from app.services import upstreams
+from app.services.stats import StatsAccumulator
+from app.utils import DEFAULT_TOKEN_TTL, decode_jwt_expiry
 
-import pandas as pd
+import numpy as np
 
 
 TB_URL = os.getenv("THINGSBOARD_URL")
 TB_USER = os.getenv("THINGSBOARD_USERNAME")
 TB_PASS = os.getenv("THINGSBOARD_PASSWORD")
 
+class ThingsBoardAuthError(requests.exceptions.RequestException):
+    """Raised when no valid ThingsBoard token could be obtained."""
+
+
+class ThingsBoardCredentials:
+    """
+    Process-wide cache of the ThingsBoard JWT.
+
+    The token is reused until `refresh_margin` seconds before its expiry, so
+    jobs make one login per token lifetime instead of one per request. The
+    lock guarantees that concurrent jobs racing on an expired token trigger a
+    single login.
+    """
+
+    def __init__(self, http: requests.Session, refresh_margin: int = 60):
+        self._http = http
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+
+    def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        with self._lock:
+            if force_refresh or not self._token or time.time() >= self._expires_at - self._refresh_margin:
+                self._token = self._login()
+                expiry = decode_jwt_expiry(self._token)
+                self._expires_at = expiry if expiry else time.time() + DEFAULT_TOKEN_TTL
+            return self._token
+
+    def invalidate(self, token: Optional[str] = None):
+        """Drop the cached token, unless another thread already replaced it."""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _login(self) -> Optional[str]:
+        try:
+            with upstreams.limit(upstreams.THINGSBOARD):
+                r = self._http.post(
+                    f"{settings.THINGSBOARD_URL}/api/auth/login",
+                    json={"username": settings.THINGSBOARD_USERNAME, "password": settings.THINGSBOARD_PASSWORD},
+                    timeout=settings.THINGSBOARD_TIMEOUT)
+            r.raise_for_status()
+            logging.info("Authenticated successfully!")
+            return r.json()["token"]
+        except Exception as e:
+            logging.error(f"Login failed: {e}")
+            return None
+
+
+def _create_session() -> requests.Session:
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.THINGSBOARD_POOL_SIZE)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+
+# Shared keep-alive session and token cache used by every ThingsBoard call
+session = _create_session()
+credentials = ThingsBoardCredentials(session, refresh_margin=settings.THINGSBOARD_TOKEN_REFRESH_MARGIN)
+
+
+def _request(method, path, headers: Optional[Dict] = None, **kwargs) -> requests.Response:
+    """
+    Send an authenticated request to ThingsBoard through the pooled session.
+
+    A 401 answer invalidates the cached token and the request is retried once
+    with a freshly issued one.
+    """
+    url = f"{settings.THINGSBOARD_URL}{path}"
+    kwargs.setdefault("timeout", settings.THINGSBOARD_TIMEOUT)
+    response = None
+    for _ in range(2):
+        token = credentials.get_token()
+        if not token:
+            raise ThingsBoardAuthError("Could not authenticate to ThingsBoard")
+        with upstreams.limit(upstreams.THINGSBOARD):
+            response = session.request(
+                method, url, headers={**(headers or {}), "X-Authorization": f"Bearer {token}"}, **kwargs)
+        if response.status_code != 401:
+            break
+        logging.warning("ThingsBoard token rejected, logging in again")
+        credentials.invalidate(token)
+    return response # type: ignore [reportReturnType]
+
 
 def login_tb():
-    try:
-        r = requests.post(
-            f"{settings.THINGSBOARD_URL}/api/auth/login",
-            json={"username": settings.THINGSBOARD_USERNAME, "password": settings.THINGSBOARD_PASSWORD})
-        r.raise_for_status()
-        logging.info("Authenticated successfully!")
-        return r.json()["token"]
-    except Exception as e:
-        logging.error(f"Login failed: {e}")
-        return None
+    return credentials.get_token()
 
 
-def logout_tb(token):
+def logout_tb():
+    token = credentials.get_token()
+    credentials.invalidate(token)
     try:
-        requests.post(f"{settings.THINGSBOARD_URL}/api/auth/logout", headers={"X-Authorization": f"Bearer {token}"})
+        session.post(f"{settings.THINGSBOARD_URL}/api/auth/logout", headers={"X-Authorization": f"Bearer {token}"})
     except:
         pass
 
@@ -41,62 +128,189 @@ def get_time_range():
     return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
 
 
-def get_telemetry_for_current_day(device_id, keys, token):
-    headers = {"X-Authorization": f"Bearer {token}"}
+def timeseries_path(device_id) -> str:
+    return f"/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+
+
+def current_day_params(keys) -> Dict:
     start_ts, end_ts = get_time_range()
-    params = {
+    return {
         "keys": ",".join(keys),
         "startTs": start_ts,
         "endTs": end_ts,
         "limit": 10000,
         "orderBy": "ASC"
     }
-    url = f"{settings.THINGSBOARD_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
-    r = requests.get(url, headers=headers, params=params)
+
+
+def get_telemetry_for_current_day(device_id, keys):
+    r = _request("GET", timeseries_path(device_id), params=current_day_params(keys))
     r.raise_for_status()
     return r.json()
 
-def get_all_telemetry_for_key_df(device_id, key, start_date, token):
-    headers = {"X-Authorization": f"Bearer {token}"}
-    start_ts = int(pd.to_datetime(start_date).timestamp() * 1000)
-    end_ts = int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
-    params = {
-        "keys": key,
+# ThingsBoard aggregation function behind each daily statistic
+DAILY_AGGREGATES = {"min": "MIN", "max": "MAX", "avg": "AVG", "count": "COUNT"}
+
+
+def aggregation_params(keys, start_ts, end_ts, agg, interval=None) -> Dict:
+    return {
+        "keys": ",".join(keys),
         "startTs": start_ts,
         "endTs": end_ts,
-        "limit": 10000,
-        "orderBy": "DESC"
+        "interval": interval or (end_ts - start_ts),
+        "agg": agg,
+        "limit": settings.THINGSBOARD_PAGE_LIMIT,
+        "orderBy": "ASC"
     }
-    url = f"{settings.THINGSBOARD_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
-    r = requests.get(url, headers=headers, params=params)
-    r.raise_for_status()
-    data = r.json()
-
-    # Convert to DataFrame
-    if key not in data:
-        raise ValueError(f"No data found for key '{key}'")
 
-    records = data[key]
-    df = pd.DataFrame([{
-        "timestamp": int(r["ts"]),
-        key: float(r["value"])
-    } for r in records])
 
-    df["datetime"] = pd.to_datetime(df["timestamp"], unit='ms')
-    df.set_index("datetime", inplace=True)
-    df = df.iloc[::-1]
-    return df
+def get_aggregated_telemetry(device_id, keys, start_ts, end_ts, agg, interval=None):
+    """Ask ThingsBoard to reduce the keys over [start_ts, end_ts) in buckets of `interval` ms."""
+    r = _request("GET", timeseries_path(device_id), params=aggregation_params(keys, start_ts, end_ts, agg, interval))
+    r.raise_for_status()
+    return r.json()
 
 
-def get_asset_info(asset_id, token) -> dict:
-    url = f"{settings.THINGSBOARD_URL}/api/asset/{asset_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {token}"
-    }
+def daily_stats_from_aggregates(keys, results: Dict[str, Dict]) -> Dict[str, Dict[str, float]]:
+    """Build per-key stats from the {stat name: TB response} aggregation results."""
+    stats = {}
+    for key in keys:
+        buckets = {name: results[name].get(key) for name in DAILY_AGGREGATES}
+        if not all(buckets.values()):
+            continue
+        stats[key] = {name: float(b[0]["value"]) for name, b in buckets.items()} # type: ignore [reportOptionalSubscript]
+        stats[key]['count'] = int(stats[key]['count'])
+        stats[key]['std'] = None # type: ignore [reportArgumentType]
+    return stats
+
+
+def daily_stats_from_raw(keys, telemetry: Dict) -> Dict[str, Dict[str, float]]:
+    stats = {}
+    for key in keys:
+        values = [float(dp["value"]) for dp in telemetry.get(key, []) if "value" in dp]
+        if values:
+            stats[key] = StatsAccumulator.from_array(values).as_dict()
+    return stats
+
+
+def use_aggregated_daily_stats(with_std: Optional[bool] = None) -> bool:
+    if with_std is None:
+        with_std = settings.THINGSBOARD_DAILY_STATS_STD
+    return settings.THINGSBOARD_DAILY_STATS_MODE == "aggregate" and not with_std
+
+
+def get_daily_stats_for_current_day(device_id, keys, with_std: Optional[bool] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Daily min/max/avg/count per key.
+
+    In "aggregate" mode the reductions run inside ThingsBoard, one request per
+    aggregation function returning a single bucket per key. Raw points are only
+    downloaded for keys whose aggregates are missing, when the server rejects
+    aggregation, or for every key when the standard deviation is requested
+    (TB has no such aggregation). Otherwise 'std' is None.
+    """
+    start_ts, end_ts = get_time_range()
+    stats: Dict[str, Dict[str, float]] = {}
+
+    if use_aggregated_daily_stats(with_std):
+        try:
+            with ThreadPoolExecutor(max_workers=len(DAILY_AGGREGATES)) as executor:
+                results = dict(zip(DAILY_AGGREGATES, executor.map(
+                    lambda agg: get_aggregated_telemetry(device_id, keys, start_ts, end_ts, agg),
+                    DAILY_AGGREGATES.values())))
+            stats = daily_stats_from_aggregates(keys, results)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Aggregated telemetry unavailable for device {device_id}, using raw values: {e}")
+
+    raw_keys = [k for k in keys if k not in stats]
+    if raw_keys:
+        stats.update(daily_stats_from_raw(raw_keys, get_telemetry_for_current_day(device_id, raw_keys)))
+
+    return stats
+
+
+def split_time_range(start_ts, end_ts, window_ms) -> List[Tuple[int, int]]:
+    """Split [start_ts, end_ts) into consecutive half-open windows of at most window_ms."""
+    windows = []
+    while start_ts < end_ts:
+        windows.append((start_ts, min(start_ts + window_ms, end_ts)))
+        start_ts += window_ms
+    return windows
+
+
+def _fetch_window(device_id, key, start_ts, end_ts, limit) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fetch every point of one window in ascending order. A page that comes back
+    full is continued from its last timestamp, so dense windows are not cut off.
+    """
+    ts_chunks, value_chunks = [], []
+    while start_ts < end_ts:
+        params = {
+            "keys": key,
+            "startTs": start_ts,
+            "endTs": end_ts,
+            "limit": limit,
+            "orderBy": "ASC"
+        }
+        r = _request("GET", timeseries_path(device_id), params=params)
+        r.raise_for_status()
+        records = r.json().get(key, [])
+        if not records:
+            break
+
+        ts_chunks.append(np.fromiter((p["ts"] for p in records), dtype=np.int64, count=len(records)))
+        value_chunks.append(np.fromiter((p["value"] for p in records), dtype=np.float64, count=len(records)))
+        if len(records) < limit:
+            break
+        start_ts = int(ts_chunks[-1][-1]) + 1
+
+    if not ts_chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(ts_chunks), np.concatenate(value_chunks)
+
+
+def get_telemetry_arrays(
+        device_id, key, start_ts, end_ts,
+        window_days: Optional[float] = None,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fetch the full history of one key between start_ts and end_ts (ms).
+
+    The range is split into windows that are fetched concurrently by a bounded
+    worker pool and stitched back together in time order. `progress` is called
+    with (completed_windows, total_windows) after every window.
+
+    Returns a pair of arrays: timestamps in ms (int64) and values (float64).
+    """
+    window_ms = int((window_days or settings.THINGSBOARD_HISTORY_WINDOW_DAYS) * 86400 * 1000)
+    windows = split_time_range(int(start_ts), int(end_ts), window_ms)
+    if not windows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    limit = settings.THINGSBOARD_PAGE_LIMIT
+    results: List[Tuple[np.ndarray, np.ndarray]] = [None] * len(windows) # type: ignore [reportAssignmentType]
+    max_workers = min(workers or settings.THINGSBOARD_HISTORY_WORKERS, len(windows))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_fetch_window, device_id, key, w_start, w_end, limit): i
+            for i, (w_start, w_end) in enumerate(windows)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            logging.debug(f"Fetched {key} history window {done}/{len(windows)} for device {device_id}")
+            if progress:
+                progress(done, len(windows))
+
+    return (np.concatenate([ts for ts, _ in results]),
+            np.concatenate([values for _, values in results]))
+
+
+def get_asset_info(asset_id) -> dict:
+    headers = {"Content-Type": "application/json"}
 
     try:
-        response = requests.get(url, headers=headers)
+        response = _request("GET", f"/api/asset/{asset_id}", headers=headers)
         if response.status_code == 200:
             return response.json()
         elif response.status_code == 404:
@@ -110,28 +324,27 @@ def get_asset_info(asset_id, token) -> dict:
         return {}
 
 
-def get_devices_by_asset(asset_id, token):
-    url = f"{settings.THINGSBOARD_URL}/api/relations/info?fromId={asset_id}&fromType=ASSET"
-    headers = {"X-Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+def device_names_from_relations(relations) -> List[str]:
+    device_names = []
+    for relation in relations:
+        if relation["to"]["entityType"] == "DEVICE":
+            device_names.append(relation["toName"])
+    return device_names
+
+
+def get_devices_by_asset(asset_id):
+    response = _request("GET", f"/api/relations/info?fromId={asset_id}&fromType=ASSET")
     
     if response.ok:
-        relations = response.json()
-        device_names = []
-        for relation in relations:
-            if relation["to"]["entityType"] == "DEVICE":
-                device_names.append(relation["toName"])
-        return device_names
+        return device_names_from_relations(response.json())
     else:
         logging.error(f"Failed to fetch relations for asset {asset_id}")
         return []
 
 
 
-def get_asset_attributes(asset_id, token):
-    url = f"{settings.THINGSBOARD_URL}/api/plugins/telemetry/ASSET/{asset_id}/values/attributes/SERVER_SCOPE"
-    headers = {"X-Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+def get_asset_attributes(asset_id):
+    response = _request("GET", f"/api/plugins/telemetry/ASSET/{asset_id}/values/attributes/SERVER_SCOPE")
     if response.ok:
         attr_list = response.json()
         return {attr["key"]: attr["value"] for attr in attr_list}
@@ -140,13 +353,10 @@ def get_asset_attributes(asset_id, token):
         return {}
 
 
-def get_asset_info_from_device(device_id, token):
-    headers = {"X-Authorization": f"Bearer {token}"}
-    url = f"{settings.THINGSBOARD_URL}/api/relations?toId={device_id}&toType=DEVICE"
-    
+def get_asset_info_from_device(device_id):
     try:
         # Send the request to ThingsBoard to get the device relations
-        r = requests.get(url, headers=headers)
+        r = _request("GET", f"/api/relations?toId={device_id}&toType=DEVICE")
         r.raise_for_status()  # Raise error if the request fails
         relations = r.json()
 
@@ -166,16 +376,13 @@ def get_asset_info_from_device(device_id, token):
         return None
 
 
-def post_recommendation_to_tb(asset_id, recommendations: Dict, token):
-    url = f"{settings.THINGSBOARD_URL}/api/plugins/telemetry/ASSET/{asset_id}/timeseries/ANY"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Authorization": f"Bearer {token}"
-    }
-    response = requests.post(url, json=recommendations, headers=headers)
+def post_recommendation_to_tb(asset_id, recommendations: Dict):
+    headers = {"Content-Type": "application/json"}
+    response = _request("POST", f"/api/plugins/telemetry/ASSET/{asset_id}/timeseries/ANY",
+                        json=recommendations, headers=headers)
     response.raise_for_status()
 
     if not response.ok:
         return False
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.config import settings
+from app.services import upstreams
+import app.services.thingsboard as tb
+
+
+class AsyncThingsBoardClient:
+    """
+    asyncio counterpart of the ThingsBoard helpers in `thingsboard`, for jobs
+    that fan independent calls out concurrently.
+
+    It shares the process-wide token cache with the blocking helpers, so both
+    flavours reuse the same login. Use it as an async context manager:
+
+        async with AsyncThingsBoardClient() as client:
+            attrs, devices = await asyncio.gather(
+                client.get_asset_attributes(asset_id),
+                client.get_devices_by_asset(asset_id))
+    """
+
+    def __init__(self, credentials: tb.ThingsBoardCredentials = tb.credentials):
+        self._credentials = credentials
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            base_url=settings.THINGSBOARD_URL or "",
+            limits=httpx.Limits(max_connections=settings.THINGSBOARD_POOL_SIZE),
+            timeout=settings.THINGSBOARD_TIMEOUT)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method, path, headers: Optional[Dict] = None, **kwargs) -> httpx.Response:
+        response = None
+        for _ in range(2):
+            # Logging in is rare and guarded by a lock, so it runs off the event loop
+            token = await asyncio.to_thread(self._credentials.get_token)
+            if not token:
+                raise tb.ThingsBoardAuthError("Could not authenticate to ThingsBoard")
+            async with upstreams.limit_async(upstreams.THINGSBOARD):
+                response = await self._client.request( # type: ignore [reportOptionalMemberAccess]
+                    method, path, headers={**(headers or {}), "X-Authorization": f"Bearer {token}"}, **kwargs)
+            if response.status_code != 401:
+                break
+            logging.warning("ThingsBoard token rejected, logging in again")
+            self._credentials.invalidate(token)
+        return response # type: ignore [reportReturnType]
+
+    async def get_asset_info(self, asset_id) -> dict:
+        try:
+            response = await self._request("GET", f"/api/asset/{asset_id}", headers={"Content-Type": "application/json"})
+        except (httpx.HTTPError, tb.ThingsBoardAuthError) as e:
+            logging.error(f"An error occurred: {e}")
+            return {}
+        if response.status_code == 200:
+            return response.json()
+        elif response.status_code == 404:
+            logging.error(f"Asset with ID '{asset_id}' not found.")
+        else:
+            logging.error(f"Failed to retrieve asset. Status code: {response.status_code}")
+        return {}
+
+    async def get_asset_attributes(self, asset_id) -> Dict:
+        response = await self._request("GET", f"/api/plugins/telemetry/ASSET/{asset_id}/values/attributes/SERVER_SCOPE")
+        if response.is_success:
+            return {attr["key"]: attr["value"] for attr in response.json()}
+        logging.error(f"Failed to fetch attributes for asset {asset_id}")
+        return {}
+
+    async def get_devices_by_asset(self, asset_id) -> List[str]:
+        response = await self._request("GET", f"/api/relations/info?fromId={asset_id}&fromType=ASSET")
+        if response.is_success:
+            return tb.device_names_from_relations(response.json())
+        logging.error(f"Failed to fetch relations for asset {asset_id}")
+        return []
+
+    async def get_telemetry_for_current_day(self, device_id, keys) -> Dict:
+        r = await self._request("GET", tb.timeseries_path(device_id), params=tb.current_day_params(keys))
+        r.raise_for_status()
+        return r.json()
+
+    async def get_aggregated_telemetry(self, device_id, keys, start_ts, end_ts, agg, interval=None) -> Dict:
+        r = await self._request("GET", tb.timeseries_path(device_id),
+                                params=tb.aggregation_params(keys, start_ts, end_ts, agg, interval))
+        r.raise_for_status()
+        return r.json()
+
+    async def get_daily_stats_for_current_day(self, device_id, keys, with_std: Optional[bool] = None) -> Dict[str, Dict[str, float]]:
+        """See `thingsboard.get_daily_stats_for_current_day`; the aggregations are gathered concurrently."""
+        start_ts, end_ts = tb.get_time_range()
+        stats: Dict[str, Dict[str, float]] = {}
+
+        if tb.use_aggregated_daily_stats(with_std):
+            try:
+                results = await asyncio.gather(*(
+                    self.get_aggregated_telemetry(device_id, keys, start_ts, end_ts, agg)
+                    for agg in tb.DAILY_AGGREGATES.values()))
+                stats = tb.daily_stats_from_aggregates(keys, dict(zip(tb.DAILY_AGGREGATES, results)))
+            except (httpx.HTTPError, tb.ThingsBoardAuthError) as e:
+                logging.warning(f"Aggregated telemetry unavailable for device {device_id}, using raw values: {e}")
+
+        raw_keys = [k for k in keys if k not in stats]
+        if raw_keys:
+            stats.update(tb.daily_stats_from_raw(raw_keys, await self.get_telemetry_for_current_day(device_id, raw_keys)))
+
+        return stats
+
+    async def post_recommendation_to_tb(self, asset_id, recommendations: Dict) -> bool:
+        response = await self._request("POST", f"/api/plugins/telemetry/ASSET/{asset_id}/timeseries/ANY",
+                                       json=recommendations, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+        return response.is_success
@@ -0,0 +1,325 @@
+import asyncio
+import datetime
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import websockets
+
+from app.config import settings
+from app.db.database import get_db
+import app.db.crud as dao
+from app.services import telemetry_store as store
+from app.services import phase_tracker as phases
+from app.services.pile_monitor import PhaseStateMachine
+from app.services.stats import StatsAccumulator, day_start_ms
+import app.services.thingsboard as tb
+
+@dataclass
+class _Series:
+    pile_id: int
+    device_id: str
+    key: str
+    live: bool = False  # Backfilled from REST and following the stream
+    last_ts: int = -1  # Newest point folded into the stats and phase state
+    day_start: int = 0
+    stats: StatsAccumulator = field(default_factory=StatsAccumulator)  # Points of the current UTC day
+    temperature: bool = False  # Followed by a phase state
+    phase: Optional[PhaseStateMachine] = None
+    tail: List[Tuple[int, float]] = field(default_factory=list)  # Raw points the next grid points depend on
+    pending: List[Tuple[int, float]] = field(default_factory=list)  # Streamed, not folded yet
+
+
+@dataclass
+class _Device:
+    pile_id: int
+    device_id: str
+    keys: List[str]
+    start_date: object
+    cmd_id: int
+
+
+class ThingsBoardTelemetryStream:
+    """
+    Real-time ingestion of ThingsBoard telemetry over its WebSocket API.
+
+    Every watched device gets a LATEST_TELEMETRY subscription. Points are
+    buffered in memory and flushed to the local telemetry store in batches,
+    while the daily statistics and the temperature phase state of each series
+    are advanced as points arrive. After every (re)connection the series are
+    backfilled over REST from their watermark, and their buffers are only
+    flushed once that backfill is done, so the store never gets a gap.
+
+    The stream runs its own event loop in a daemon thread. `url` defaults to
+    THINGSBOARD_WS_URL, or to the telemetry endpoint of THINGSBOARD_URL, and
+    can point to any local stand-in speaking the same protocol.
+    """
+
+    def __init__(self, url: Optional[str] = None, batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None):
+        self._url = url
+        self._batch_size = batch_size or settings.THINGSBOARD_STREAM_BATCH_SIZE
+        self._flush_interval = flush_interval or settings.THINGSBOARD_STREAM_FLUSH_INTERVAL
+        self._lock = threading.Lock()
+        self._devices: Dict[Tuple[int, str], _Device] = {}
+        self._series: Dict[Tuple[int, str, str], _Series] = {}
+        self._buffer: Dict[Tuple[int, str, str], List[Tuple[int, float]]] = {}
+        self._buffered = 0
+        self._next_cmd_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ws = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._tasks = set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _ws_url(self) -> str:
+        base = self._url or settings.THINGSBOARD_WS_URL
+        if not base:
+            base = (settings.THINGSBOARD_URL or "").replace("https://", "wss://").replace("http://", "ws://")
+            base = f"{base}/api/ws/plugins/telemetry"
+        return f"{base}?token={tb.login_tb()}"
+
+    # Public API, safe to call from any thread
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run_forever, name="tb-telemetry-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stopping = True
+        if self._loop and self._ws:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def watch(self, pile_id: int, device_id: str, keys: List[str], start_date):
+        """Subscribe to the keys of a device and backfill them. Idempotent."""
+        with self._lock:
+            if (pile_id, device_id) in self._devices:
+                return
+            device = _Device(pile_id, device_id, list(keys), start_date, self._next_cmd_id)
+            self._next_cmd_id += 1
+            self._devices[(pile_id, device_id)] = device
+            for key in keys:
+                self._series[(pile_id, device_id, key)] = _Series(pile_id, device_id, key, temperature='temp' in key.lower())
+        if self._loop and self._ws:
+            asyncio.run_coroutine_threadsafe(self._subscribe([device]), self._loop)
+
+    def get_daily_stats(self, pile_id: int, device_id: str, keys: List[str]) -> Optional[Dict[str, Dict[str, float]]]:
+        """Today's stats of the device keys, or None unless all of them are live."""
+        today = day_start_ms(int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000))
+        stats = {}
+        with self._lock:
+            for key in keys:
+                series = self._series.get((pile_id, device_id, key))
+                if not series or not series.live:
+                    return None
+                if series.day_start == today and series.stats.count:
+                    stats[key] = series.stats.as_dict()
+        return stats
+
+    # Event loop side
+
+    def _run_forever(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._run())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def _run(self):
+        backoff = 1
+        flusher = asyncio.create_task(self._flush_periodically())
+        while not self._stopping:
+            try:
+                async with websockets.connect(self._ws_url()) as ws:
+                    self._ws = ws
+                    backoff = 1
+                    logging.info("Connected to ThingsBoard telemetry stream")
+                    with self._lock:
+                        devices = list(self._devices.values())
+                        for series in self._series.values():
+                            series.live = False
+                    await self._subscribe(devices)
+                    async for message in ws:
+                        self._on_message(message)
+            except Exception as e:
+                if not self._stopping:
+                    logging.warning(f"ThingsBoard telemetry stream disconnected: {e}")
+            finally:
+                self._ws = None
+            if not self._stopping:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+        flusher.cancel()
+        await asyncio.to_thread(self._flush)
+
+    async def _subscribe(self, devices: List[_Device]):
+        if not devices or not self._ws:
+            return
+        await self._ws.send(json.dumps({
+            "tsSubCmds": [{
+                "entityType": "DEVICE",
+                "entityId": d.device_id,
+                "scope": "LATEST_TELEMETRY",
+                "keys": ",".join(d.keys),
+                "cmdId": d.cmd_id
+            } for d in devices],
+            "historyCmds": [],
+            "attrSubCmds": []
+        }))
+        # Subscribe first, then backfill, so nothing between the two is missed
+        for device in devices:
+            for key in device.keys:
+                task = asyncio.create_task(self._backfill(device, key))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _backfill(self, device: _Device, key: str):
+        try:
+            seed = await asyncio.to_thread(self._load_seed, device, key)
+        except Exception as e:
+            logging.error(f"Backfill of '{key}' for device {device.device_id} failed: {e}")
+            return
+        with self._lock:
+            series = self._series[(device.pile_id, device.device_id, key)]
+            series.last_ts, series.day_start, series.stats, series.phase, series.tail = seed
+            series.live = True
+            self._fold(series)
+        logging.info(f"Streaming '{key}' of device {device.device_id}")
+
+    def _load_seed(self, device: _Device, key: str):
+        """
+        Sync the series from its watermark, then rebuild today's stats and the
+        phase state from the store: the stored phase state is advanced as the
+        daily jobs do, and only the raw points after it are kept in memory.
+        """
+        store.sync_thingsboard_series(device.pile_id, device.device_id, key, device.start_date)
+        day_start = day_start_ms(int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000))
+        phase, tail = None, []
+        if 'temp' in key.lower():
+            phase, _ = phases.advance_phase_state(device.pile_id, device.device_id, key)
+        with get_db() as db:
+            watermark = dao.get_telemetry_watermark(db, device.pile_id, device.device_id, key)
+            _, values = dao.get_telemetry(db, device.pile_id, device.device_id, key, day_start)
+            if 'temp' in key.lower():
+                ts, tail_values = dao.get_telemetry(db, device.pile_id, device.device_id, key, phases.tail_start_ms(phase))
+                tail = list(zip(ts.tolist(), tail_values.tolist()))
+        stats = StatsAccumulator.from_array(values)
+        return -1 if watermark is None else watermark, day_start, stats, phase, tail
+
+    def _on_message(self, message):
+        payload = json.loads(message)
+        if payload.get("errorCode"):
+            logging.error(f"ThingsBoard subscription {payload.get('subscriptionId')} failed: {payload.get('errorMsg')}")
+            return
+        with self._lock:
+            device = next((d for d in self._devices.values() if d.cmd_id == payload.get("subscriptionId")), None)
+            if not device:
+                return
+            for key, points in (payload.get("data") or {}).items():
+                series = self._series.get((device.pile_id, device.device_id, key))
+                if not series:
+                    continue
+                for ts, value in points:
+                    try:
+                        point = (int(ts), float(value))
+                    except (TypeError, ValueError):
+                        continue
+                    self._buffer.setdefault((device.pile_id, device.device_id, key), []).append(point)
+                    self._buffered += 1
+                    series.pending.append(point)
+                if series.live:
+                    self._fold(series)
+            flush = self._buffered >= self._batch_size
+        if flush:
+            future = asyncio.get_running_loop().run_in_executor(None, self._flush)
+            future.add_done_callback(self._log_flush_error)
+
+    def _fold(self, series: _Series):
+        """Advance stats and phase state over the pending points newer than the series state."""
+        for ts, value in sorted(series.pending):
+            if ts <= series.last_ts:
+                continue
+            day_start = day_start_ms(ts)
+            if day_start != series.day_start:
+                series.day_start, series.stats = day_start, StatsAccumulator()
+            series.stats.update(value)
+            if series.temperature:
+                series.tail.append((ts, value))
+            series.last_ts = ts
+        series.pending.clear()
+        if series.temperature:
+            self._advance_phase(series)
+
+    def _advance_phase(self, series: _Series):
+        """Advance the phase state over the grid points completed by the tail, as the daily jobs do."""
+        if not series.tail:
+            return
+        ts = np.fromiter((p[0] for p in series.tail), dtype=np.int64, count=len(series.tail))
+        values = np.fromiter((p[1] for p in series.tail), dtype=np.float64, count=len(series.tail))
+        series.phase, changes, points = phases.advance(series.phase, ts, values)
+        for when, change in changes:
+            logging.info(f"Pile {series.pile_id}: {change} at {when}")
+        if points:
+            start = phases.tail_start_ms(series.phase)
+            series.tail = [p for p in series.tail if p[0] >= start] # type: ignore [reportOperatorIssue]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await asyncio.to_thread(self._flush)
+            except Exception as e:
+                logging.error(f"Flushing the ThingsBoard telemetry stream failed: {e}")
+
+    @staticmethod
+    def _log_flush_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logging.error(f"Flushing the ThingsBoard telemetry stream failed: {future.exception()}")
+
+    def _flush(self):
+        """
+        Write the buffers of live series to the store, one transaction per series.
+        Series still being backfilled keep their buffer, as storing their points
+        would move the watermark past the part not backfilled yet. The points of a
+        failed transaction go back to their buffer for the next flush.
+        """
+        with self._lock:
+            ready = {k: v for k, v in self._buffer.items() if v and self._series[k].live}
+            for k in ready:
+                self._buffer[k] = []
+            self._buffered -= sum(len(v) for v in ready.values())
+        failed = {}
+        for (pile_id, device_id, key), points in ready.items():
+            points.sort()
+            try:
+                with get_db() as db:
+                    dao.insert_telemetry(
+                        db, pile_id, device_id, key,
+                        np.fromiter((p[0] for p in points), dtype=np.int64, count=len(points)),
+                        np.fromiter((p[1] for p in points), dtype=np.float64, count=len(points)))
+            except Exception as e:
+                logging.error(f"Storing {len(points)} streamed '{key}' points of device {device_id} failed: {e}")
+                failed[(pile_id, device_id, key)] = points
+        if failed:
+            with self._lock:
+                for k, points in failed.items():
+                    self._buffer[k] = points + self._buffer.get(k, [])
+                    self._buffered += len(points)
+
+
+# Process-wide stream, started by the scheduler when THINGSBOARD_STREAMING is set
+stream = ThingsBoardTelemetryStream()
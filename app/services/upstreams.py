@@ -0,0 +1,53 @@
+import asyncio
+import contextlib
+import threading
+from typing import Dict
+
+from app.config import settings
+
+THINGSBOARD = "thingsboard"
+DATACAKE = "datacake"
+FARM_CALENDAR = "farm_calendar"
+WEATHER = "weather"
+
+_POLL_INTERVAL = 0.005  # Seconds between attempts to get a slot, doubled up to _POLL_INTERVAL_MAX
+_POLL_INTERVAL_MAX = 0.1
+
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_semaphores_lock = threading.Lock()
+
+
+def _semaphore(upstream: str) -> threading.BoundedSemaphore:
+    with _semaphores_lock:
+        if upstream not in _semaphores:
+            _semaphores[upstream] = threading.BoundedSemaphore(settings.UPSTREAM_CONCURRENCY.get(upstream, 4))
+        return _semaphores[upstream]
+
+
+@contextlib.contextmanager
+def limit(upstream: str):
+    """Hold one of the process-wide request slots of an upstream service."""
+    semaphore = _semaphore(upstream)
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+@contextlib.asynccontextmanager
+async def limit_async(upstream: str):
+    """
+    `limit` for coroutines; waiting for a slot does not block the event loop.
+    The slot is polled for rather than waited for in a thread, so a task
+    cancelled while waiting never takes a slot it would not release.
+    """
+    semaphore = _semaphore(upstream)
+    interval = _POLL_INTERVAL
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, _POLL_INTERVAL_MAX)
+    try:
+        yield
+    finally:
+        semaphore.release()
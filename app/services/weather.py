@@ -1 +1,47 @@
-# Weather recommendation logic
\ No newline at end of file
+# Local store of the ambient weather, per grid cell of the forecast cache
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.db.database import get_db
+import app.db.crud as dao
+
+
+def grid_cell(lat, lon, precision: Optional[int] = None) -> Tuple[float, float]:
+    precision = precision if precision is not None else settings.WEATHER_GRID_PRECISION
+    return round(float(lat), precision), round(float(lon), precision)
+
+
+def _to_ms(value) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def save_forecast(lat, lon, forecast) -> int:
+    """
+    Store every value of a parsed forecast (see `weather_service.Forecast`).
+    Newer forecasts replace older ones for the same time, so the past of the
+    series holds the latest forecast made for it. Returns the number of stored values.
+    """
+    if not len(forecast.ts):
+        return 0
+    with get_db() as db:
+        return dao.insert_ambient_weather(db, *grid_cell(lat, lon), forecast.ts, dict(forecast.values))
+
+
+def get_ambient_series(lat, lon, prop: str, start: Optional[datetime] = None,
+                       end: Optional[datetime] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stored (ts, value) arrays of one property near the given coordinates,
+    between `start` (included) and `end` (excluded), in ascending time order.
+    Both bounds may also be given in epoch ms.
+    """
+    with get_db() as db:
+        return dao.get_ambient_weather(db, *grid_cell(lat, lon), prop, _to_ms(start), _to_ms(end))
@@ -1,11 +1,24 @@
 
 # Observed Properties map
-from datetime import timezone, datetime, timedelta
-from typing import Dict, List
+import json
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import timezone, datetime
+from typing import Dict, Optional, Tuple
 from dateutil import parser as date_parser
+import numpy as np
+import pandas as pd
 import requests
 
 from app.config import settings
+from app.db.database import get_db
+import app.db.crud as dao
+from app.services import upstreams
+from app.services import weather as ambient
+from app.services.gatekeeper import gatekeeper
 
 
 OBSERVED_PROPERTIES = {
@@ -16,51 +29,161 @@ OBSERVED_PROPERTIES = {
 
 def get_5days_forecast(api_url, lat, lon, token):
     params = {"lat": lat, "lon": lon}
-    headers = {"Authorization": f"Bearer {token}"}
 
-    response = requests.get(api_url, params=params, headers=headers) # pylint: disable=W3101
+    response = gatekeeper.request("GET", api_url, token, upstream=upstreams.WEATHER, params=params)
     response.raise_for_status()
     return response.json()
 
-def get_24h_forecast(lat, lon, token) -> Dict[str, List[float]]:
-    url = f"{settings.WEATHER_SERVICE_URL}/api/linkeddata/forecast5"
-    url = "https://wd.sip5.horizon-openagri.eu/api/linkeddata/forecast5"
-    params = {"lat": lat, "lon": lon}
-    headers = {"Authorization": f"Bearer {token}"}
+class ForecastCache:
+    """
+    Cache of the 5-day forecasts by grid cell.
 
-    response = requests.get(url, params=params, headers=headers) # pylint: disable=W3101
-    response.raise_for_status()
-    forecast_json = response.json()
+    Coordinates are rounded to `precision` decimals (2 is about 1 km), so all
+    piles of a farm share one forecast, which is requested for the cell itself.
+    A response is reused for `ttl` seconds, in line with how often the
+    provider updates its forecasts, and is kept in the database so restarts do
+    not refetch it. Concurrent requests for the same cell wait for one fetch.
+    Every fetched forecast is also added to the ambient weather store.
+    If a refresh fails, an expired forecast is still used.
+    """
+
+    def __init__(self, precision: Optional[int] = None, ttl: Optional[float] = None):
+        self._precision = precision if precision is not None else settings.WEATHER_GRID_PRECISION
+        self._ttl = ttl if ttl is not None else settings.WEATHER_FORECAST_TTL
+        self._lock = threading.Lock()
+        self._cell_locks: Dict[Tuple[float, float], threading.RLock] = {}
+        self._forecasts: Dict[Tuple[float, float], Tuple[int, Dict]] = {}
+        self._parsed: Dict[Tuple[float, float], Tuple[int, "Forecast"]] = {}
+
+    def cell(self, lat, lon) -> Tuple[float, float]:
+        return ambient.grid_cell(lat, lon, self._precision)
+
+    def get(self, lat, lon, token) -> Dict:
+        """The forecast5 response of the grid cell of the given coordinates."""
+        return self._get(self.cell(lat, lon), token)[1]
+
+    def get_parsed(self, lat, lon, token) -> "Forecast":
+        """The parsed forecast of the grid cell, parsed once per fetched response."""
+        cell = self.cell(lat, lon)
+        with self._cell_lock(cell):
+            fetched_at, forecast_json = self._get(cell, token)
+            parsed = self._parsed.get(cell)
+            if parsed is None or parsed[0] != fetched_at:
+                parsed = self._parsed[cell] = (fetched_at, parse_forecast(forecast_json))
+            return parsed[1]
+
+    def _cell_lock(self, cell) -> threading.RLock:
+        with self._lock:
+            return self._cell_locks.setdefault(cell, threading.RLock())
+
+    def _get(self, cell, token) -> Tuple[int, Dict]:
+        with self._cell_lock(cell):
+            cached = self._forecasts.get(cell) or self._load(cell)
+            if cached and time.time() * 1000 - cached[0] < self._ttl * 1000:
+                return cached
+            try:
+                return self._fetch(cell, token)
+            except requests.exceptions.RequestException as e:
+                if not cached:
+                    raise
+                fetched_at = datetime.fromtimestamp(cached[0] / 1000, timezone.utc)
+                logging.warning(f"Weather forecast refresh for {cell} failed, using the one from {fetched_at}: {e}")
+                return cached
+
+    def _load(self, cell) -> Optional[Tuple[int, Dict]]:
+        with get_db() as db:
+            row = dao.get_weather_forecast(db, *cell)
+            if not row:
+                return None
+            cached = (int(row.fetched_at), json.loads(row.payload)) # type: ignore [reportArgumentType]
+        self._forecasts[cell] = cached
+        return cached
+
+    def _fetch(self, cell, token) -> Tuple[int, Dict]:
+        url = f"{settings.WEATHER_SERVICE_URL}/api/linkeddata/forecast5"
+        forecast_json = get_5days_forecast(url, *cell, token)
+        fetched_at = int(time.time() * 1000)
+        with get_db() as db:
+            dao.save_weather_forecast(db, *cell, fetched_at, json.dumps(forecast_json))
+        self._forecasts[cell] = (fetched_at, forecast_json)
+
+        # Keep every forecast in the ambient weather history
+        parsed = self._parsed[cell] = (fetched_at, parse_forecast(forecast_json))
+        try:
+            ambient.save_forecast(*cell, parsed[1])
+        except Exception as e:
+            logging.error(f"Could not store the ambient forecast of {cell}: {e}")
+        return self._forecasts[cell]
+
+
+forecast_cache = ForecastCache()
 
-    now = datetime.now(timezone.utc)
-    next_24h = now + timedelta(hours=24)
 
-    forecast_data = {
-        "temperature": [],
-        "humidity": [],
-        "precipitation": [],
-    }
+@dataclass
+class Forecast(Mapping):
+    """
+    A parsed forecast: sorted UTC epoch milliseconds and one float array per
+    observed property, NaN where the property is not forecast. Reads like a
+    mapping of the property columns.
+    """
+    ts: np.ndarray
+    values: Dict[str, np.ndarray]
 
+    def __getitem__(self, key) -> np.ndarray:
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def window(self, hours: float, start: Optional[datetime] = None) -> "Forecast":
+        """The forecast between `start` (now by default) and `hours` later, both included."""
+        start_ms = int((start or datetime.now(timezone.utc)).timestamp() * 1000)
+        lo = np.searchsorted(self.ts, start_ms, side="left")
+        hi = np.searchsorted(self.ts, start_ms + int(hours * 3_600_000), side="right")
+        return Forecast(self.ts[lo:hi], {k: v[lo:hi] for k, v in self.values.items()})
+
+    def to_df(self) -> pd.DataFrame:
+        index = pd.DatetimeIndex(pd.to_datetime(self.ts, unit="ms", utc=True), name="time")
+        return pd.DataFrame(self.values, index=index)
+
+
+def parse_forecast(forecast_json) -> Forecast:
+    """Parse a forecast5 response in one pass over its items."""
+    columns = list(OBSERVED_PROPERTIES.values())
+    column_of = {prop: columns.index(key) for prop, key in OBSERVED_PROPERTIES.items()}
+    row_of: Dict[str, int] = {}
+    rows, cols, values = [], [], []
     for item in forecast_json.get("@graph", []):
-        phenomenon_time = datetime.fromisoformat(item.get("phenomenonTime")).replace(tzinfo=timezone.utc)
-        if not (now <= phenomenon_time <= next_24h):
-            continue
-
-        observations = item.get("hasMember", [])
-        for obs in observations:
-            observed_property = obs.get("observedProperty")
-            result = obs.get("hasResult", {})
-            value = result.get("numericValue")
-
-            if observed_property in OBSERVED_PROPERTIES and value is not None:
-                key = OBSERVED_PROPERTIES[observed_property]
-                forecast_data[key].append({
-                    "time": phenomenon_time,
-                    "value": value
-                })
-
-    for key in forecast_data:
-        forecast_data[key].sort(key=lambda x: x["time"])
-        forecast_data[key] = [entry["value"] for entry in forecast_data[key]]
-
-    return forecast_data
\ No newline at end of file
+        row = row_of.setdefault(item.get("phenomenonTime"), len(row_of))
+        for obs in item.get("hasMember", []):
+            col = column_of.get(obs.get("observedProperty"))
+            value = (obs.get("hasResult") or {}).get("numericValue")
+            if col is not None and value is not None:
+                rows.append(row)
+                cols.append(col)
+                values.append(value)
+
+    data = np.full((len(row_of), len(columns)), np.nan)
+    data[rows, cols] = pd.to_numeric(values, errors="coerce")
+    times = pd.to_datetime(list(row_of), utc=True, format="ISO8601")
+    ts = np.asarray(times.as_unit("ms").asi8, dtype=np.int64)
+    keep = ~np.asarray(times.isna()) & ~np.isnan(data).all(axis=1)
+    order = np.argsort(ts[keep], kind="stable")
+    ts, data = ts[keep][order], data[keep][order]
+    return Forecast(ts, {c: data[:, i].copy() for i, c in enumerate(columns)})
+
+
+def forecast_window(forecast: Forecast, hours: float, start: Optional[datetime] = None) -> Forecast:
+    return forecast.window(hours, start)
+
+
+def get_forecast(lat, lon, token) -> Forecast:
+    """The whole 5-day forecast of the grid cell of the given coordinates."""
+    return forecast_cache.get_parsed(lat, lon, token)
+
+
+def get_24h_forecast(lat, lon, token) -> Forecast:
+    return forecast_window(get_forecast(lat, lon, token), 24)
@@ -1,4 +1,7 @@
+import base64
 import datetime
+import json
+from typing import Optional
 
 from app.config import settings
 
@@ -6,8 +9,20 @@ PH_ACTIVITY_TYPE_ID = settings.PH_ACTIVITY_TYPE_ID
 TEMP_ACTIVITY_TYPE_ID = settings.TEMP_ACTIVITY_TYPE_ID
 HUMIDITY_ACTIVITY_TYPE_ID = settings.HUMIDITY_ACTIVITY_TYPE_ID
 
+# Lifetime assumed for tokens whose payload carries no readable "exp" claim
+DEFAULT_TOKEN_TTL = 900
+
+def decode_jwt_expiry(token) -> Optional[float]:
+    """Return the "exp" claim (POSIX seconds) of a JWT without verifying it."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
 # Function to create the observation payload
-def create_observation_payload(key, minn, maxx, avg, pile_name, source):
+def create_observation_payload(key, minn, maxx, avg, pile_name, source, phenomenon_time=None):
     # Determine the observed property and unit based on the variable (key)
     if any(e in key for e in ("TEMP", "temperature")):  # For temperature
         key = "Soil Temperature"
@@ -27,6 +42,13 @@ def create_observation_payload(key, minn, maxx, avg, pile_name, source):
     else:
         raise ValueError("Unknown telemetry key")
 
+    # Observations sent late keep the time they were made
+    if phenomenon_time is None:
+        phenomenon_time = datetime.datetime.now(datetime.UTC)
+    elif isinstance(phenomenon_time, datetime.datetime) and phenomenon_time.tzinfo is not None:
+        phenomenon_time = phenomenon_time.astimezone(datetime.UTC)
+    phenomenon_time = phenomenon_time.strftime('%Y-%m-%dT%H:%MZ')
+
     # Create the payload
     return {
         "@type": "Observation",
@@ -34,8 +56,8 @@ def create_observation_payload(key, minn, maxx, avg, pile_name, source):
         "observedProperty": prop,
         "activityType": f"urn:farmcalendar:FarmActivityType:{act}",
         "details": f"Values range from MIN: {minn} to MAX: {maxx}",
-        "phenomenonTime": datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%dT%H:%MZ'),
-        "hasEndDatetime": datetime.datetime.now(datetime.UTC).strftime('%Y-%m-%dT%H:%MZ'),
+        "phenomenonTime": phenomenon_time,
+        "hasEndDatetime": phenomenon_time,
         "madeBySensor": {
             "name": f"{source}"
         },
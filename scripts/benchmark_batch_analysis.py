@@ -0,0 +1,83 @@
+"""
+Check that the batch compost analysis matches `analyze_compost_status` pile
+by pile, and time both on a random fleet.
+
+    python -m scripts.benchmark_batch_analysis [--piles 5000]
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.pile_monitor import (
+    analyze_compost_status, analyze_compost_status_batch, forecast_aggregates, temperature_trend)
+
+
+def random_pile(rng: np.random.Generator, today: datetime.date):
+    """Inputs of one pile around the thresholds of the recommendation ladders."""
+    points = int(rng.choice([0, 1, 2, 50, 300]))
+    temps = rng.choice([15, 30, 45, 65, 75]) + np.cumsum(rng.normal(0, rng.choice([0.1, 1, 4]), points))
+    temp_df = pd.DataFrame({"temp_ma": pd.Series(temps).rolling(window=6, min_periods=1).mean()})
+    daily_stats = {
+        "temperature": {"avg": float(rng.choice([19.9, 20, 39.9, 40, 70, 70.1, rng.uniform(0, 80)]))},
+        "moisture": {"avg": float(rng.choice([29.9, 30, 65, 65.1, rng.uniform(0, 100)]))},
+        "ph": {"avg": float(rng.choice([5.4, 5.5, 8.5, 8.6, rng.uniform(3, 10)]))},
+    }
+    greens, browns = (int(v) for v in rng.choice([0, 1, 2, 5, 10, 40, 100], 2))
+    start_date = today - datetime.timedelta(days=int(rng.integers(0, 300)))
+    forecast = {
+        "temperature": list(rng.choice([5, 9.9, 10, 25, 30, 30.1, 35]) + rng.normal(0, rng.choice([0, 2, 8]), 8)),
+        "humidity": list(rng.uniform(20, 100, 8)),
+    }
+    if rng.random() < 0.1:
+        forecast["temperature"][int(rng.integers(0, 8))] = np.nan
+    return temp_df, daily_stats, start_date, greens, browns, forecast
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--piles", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    today = datetime.date.today()
+    piles = [random_pile(rng, today) for _ in range(args.piles)]
+
+    started = time.perf_counter()
+    expected = [
+        analyze_compost_status(temp_df, stats, start, greens, browns, forecast["temperature"], forecast["humidity"])
+        for temp_df, stats, start, greens, browns, forecast in piles]
+    scalar = time.perf_counter() - started
+
+    started = time.perf_counter()
+    trends = np.array([temperature_trend(p[0]["temp_ma"]) for p in piles])
+    aggregates = np.array([forecast_aggregates(p[5]) for p in piles])
+    prepare = time.perf_counter() - started
+
+    columns = {
+        "avg_temp": np.array([p[1]["temperature"]["avg"] for p in piles]),
+        "avg_moisture": np.array([p[1]["moisture"]["avg"] for p in piles]),
+        "avg_ph": np.array([p[1]["ph"]["avg"] for p in piles]),
+        "start_dates": np.array([p[2] for p in piles], dtype="datetime64[D]"),
+        "greens": np.array([p[3] for p in piles]),
+        "browns": np.array([p[4] for p in piles]),
+    }
+    started = time.perf_counter()
+    batch = analyze_compost_status_batch(
+        **columns, temp_points=trends[:, 0], latest_temp=trends[:, 1], temp_trend=trends[:, 2],
+        forecast_temp_min=aggregates[:, 0], forecast_temp_max=aggregates[:, 1],
+        forecast_temp_avg=aggregates[:, 2], forecast_humidity_avg=aggregates[:, 3], today=today)
+    vectorized = time.perf_counter() - started
+
+    mismatches = sum(a != b for a, b in zip(expected, batch.to_records()))
+    print(f"Equivalence: {args.piles - mismatches}/{args.piles} piles match")
+    print(f"{args.piles} piles: analyze_compost_status {scalar * 1000:.1f} ms, "
+          f"batch {vectorized * 1000:.2f} ms ({scalar / vectorized:.0f}x), "
+          f"plus {prepare * 1000:.1f} ms to reduce series and forecasts to columns")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Check that the Monte Carlo duration forecast reduces to the static estimate
+when nothing is uncertain, and time it on a random fleet.
+
+    python -m scripts.benchmark_duration_forecast [--piles 5000] [--scenarios 2000]
+"""
+import argparse
+import datetime
+import time
+from unittest import mock
+
+import numpy as np
+
+from app.config import settings
+from app.services import duration_forecast as df
+from app.services.pile_monitor import estimate_total_duration_static
+
+
+def random_pile(rng: np.random.Generator, today: datetime.date) -> df.PileConditions:
+    elapsed = int(rng.integers(0, 150))
+    measured = int(rng.integers(0, elapsed + 1))
+    temperature = rng.normal(rng.choice([35, 50, 60, 72]), 4, measured)
+    moisture = rng.normal(rng.choice([35, 48, 55, 68]), 5, measured)
+    temperature[rng.random(measured) < 0.1] = np.nan
+    return df.PileConditions(
+        today - datetime.timedelta(days=elapsed),
+        float(rng.choice([1, 5, 10, 40, 100])), float(rng.choice([1, 5, 10, 40, 100])),
+        temperature, moisture, rng.normal(15, 5, int(rng.choice([0, 3, 7]))))
+
+
+def static_mismatches(piles, today: datetime.date) -> int:
+    """Without spread and without data the forecast must be the static remaining days."""
+    blank = [df.PileConditions(p.start_date, p.greens, p.browns) for p in piles]
+    with mock.patch.object(df, "MATERIAL_SIGMA", 0.0), \
+            mock.patch.object(df, "CN_GREENS", (15, 15)), mock.patch.object(df, "CN_BROWNS", (60, 60)):
+        remaining = df.simulate_remaining_days(blank, today, scenarios=4)
+    mismatches = 0
+    for pile, days in zip(blank, remaining):
+        _, expected = estimate_total_duration_static(pile.greens, pile.browns, pile.start_date)
+        mismatches += not np.all(days == max(expected, 0))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--piles", type=int, default=5000)
+    parser.add_argument("--scenarios", type=int, default=settings.DURATION_SCENARIOS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    settings.DURATION_SCENARIOS = args.scenarios
+    rng = np.random.default_rng(args.seed)
+    today = datetime.date.today()
+    piles = [random_pile(rng, today) for _ in range(args.piles)]
+
+    mismatches = static_mismatches(piles, today)
+    print(f"Static equivalence: {args.piles - mismatches}/{args.piles} piles match")
+
+    started = time.perf_counter()
+    forecasts = df.forecast_durations(piles, today)
+    elapsed = time.perf_counter() - started
+    again = df.forecast_durations(piles, today)
+    reproducible = all(a == b for a, b in zip(forecasts, again))
+    ordered = all(all(x <= y for x, y in zip(f.remaining_days, f.remaining_days[1:]) if x is not None and y is not None)
+                  for f in forecasts)
+    print(f"{args.piles} piles x {args.scenarios} scenarios: {elapsed * 1000:.0f} ms "
+          f"({elapsed / args.piles * 1e6:.0f} us per pile), reproducible: {reproducible}, percentiles ordered: {ordered}")
+
+    cache = df.DurationForecastCache()
+    conditions = dict(enumerate(piles))
+    cache.get_many(conditions, today)
+    started = time.perf_counter()
+    cache.get_many(conditions, today)
+    print(f"Cached: {(time.perf_counter() - started) * 1000:.1f} ms for {args.piles} unchanged piles")
+    raise SystemExit(1 if mismatches or not reproducible or not ordered else 0)
+
+
+if __name__ == "__main__":
+    main()
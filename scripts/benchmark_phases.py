@@ -0,0 +1,78 @@
+"""
+Check that the vectorized phase detection matches the point by point state
+machine, and time both on long series.
+
+    python -m scripts.benchmark_phases [--points 100000] [--series 500]
+"""
+import argparse
+import dataclasses
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.pile_monitor import PhaseStateMachine
+
+
+def loop_state(temp_series: pd.Series) -> PhaseStateMachine:
+    state = PhaseStateMachine()
+    for ts, temp in temp_series.items():
+        state.update(ts, temp)
+    return state
+
+
+def same_state(a: PhaseStateMachine, b: PhaseStateMachine) -> bool:
+    for f in dataclasses.fields(PhaseStateMachine):
+        x, y = getattr(a, f.name), getattr(b, f.name)
+        if isinstance(x, float) and isinstance(y, float) and math.isnan(x) and math.isnan(y):
+            continue
+        if x != y:
+            return False
+    return True
+
+
+def random_series(rng: np.random.Generator, n: int) -> pd.Series:
+    """Random walks around the 20, 35 and 40 degree thresholds, with plateaus and gaps."""
+    base = rng.choice([15, 25, 38, 41, 50])
+    steps = rng.normal(0, rng.choice([0.2, 1, 3]), n)
+    temps = base + np.cumsum(steps)
+    if rng.random() < 0.3:
+        temps = np.where(rng.random(n) < 0.5, 39.5, 40.5)  # Flapping around 40
+    if rng.random() < 0.3:
+        temps[rng.random(n) < 0.05] = np.nan
+    index = pd.date_range("2026-01-01", periods=n, freq=f"{rng.choice([1, 20, 180])}min")
+    return pd.Series(temps, index=index).rolling(window=6, min_periods=1).mean()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--series", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    mismatches = 0
+    for _ in range(args.series):
+        series = random_series(rng, int(rng.integers(0, 3000)))
+        if not same_state(loop_state(series), PhaseStateMachine.from_series(series)):
+            mismatches += 1
+    print(f"Equivalence: {args.series - mismatches}/{args.series} random series match")
+
+    series = random_series(rng, args.points)
+    started = time.perf_counter()
+    expected = loop_state(series)
+    loop_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    actual = PhaseStateMachine.from_series(series)
+    vector_seconds = time.perf_counter() - started
+    print(f"{args.points} points: loop {loop_seconds * 1000:.1f} ms, "
+          f"vectorized {vector_seconds * 1000:.1f} ms ({loop_seconds / vector_seconds:.0f}x), "
+          f"{len(actual.phase_changes)} phase changes, match: {same_state(expected, actual)}")
+    if mismatches or not same_state(expected, actual):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()